@@ -1,6 +1,7 @@
 from typing import List
 from game_queue import Player
 import datetime
+import metrics
 
 
 MAX_MMR_RANGE = 6000
@@ -8,6 +9,9 @@ MAX_QUEUE_TIME = 60
 LINEUP_SIZE = 12
 SCORE_THRESHOLD = 1.2
 
+LINEUPS_EVALUATED = metrics.Counter("queuebot_lineups_evaluated_total",
+                                    "Candidate lineups scored while searching for the best lineups")
+
 MAX_MMR = 12000
 MIN_MMR = -1000
 def get_mmr(player: Player):
@@ -97,13 +101,16 @@ def traverse_down(cur_list, all_list):
 
     best_addition_index = None
     best_addition_score = None
+    evaluated = 0
     for group_index, group in enumerate(all_list):
         if (len(cur_list) + len(group)) > LINEUP_SIZE:
             continue
         lineup_score = compute_lineup_score(cur_list + group)
+        evaluated += 1
         if best_addition_score is None or lineup_score > best_addition_score:
             best_addition_index = group_index
             best_addition_score = lineup_score
+    LINEUPS_EVALUATED.inc(evaluated)
 
     # possible alpha beta pruning opportunity to stop if best addition score made lineup 0 or below acceptable threshold
 
@@ -0,0 +1,125 @@
+import heapq
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Set
+import game_queue
+
+
+class PlayerNameIndex:
+    """Autocomplete index over the names of the players in a queue, kept up to date by the queue's events.
+
+    Names are indexed, lowercased, in a prefix trie and in an n-gram index holding every substring of up to NGRAM_SIZE
+    characters. A search returns the names that start with the query first, then the other names that contain it, at
+    most MAX_CHOICES of them. Results for recent queries are kept in a small LRU cache until the queue changes.
+
+    Names are indexed as they were when the player was added. A queued player's name follows their discord member's
+    display name, so call refresh when a member's name changes, and refresh_all after the queue's members are
+    reloaded."""
+    NGRAM_SIZE = 3
+    MAX_CHOICES = 25  # Discord won't accept more autocomplete choices than this
+    CACHE_SIZE = 128
+
+    def __init__(self, queue: game_queue.Queue):
+        self.names: Dict[int, str] = {}  # id(player) -> name
+        self.players: Dict[int, game_queue.Player] = {}
+        self.trie = {"entries": set()}
+        self.ngrams: Dict[str, Set[int]] = defaultdict(set)
+        self.cache: OrderedDict[str, List[str]] = OrderedDict()
+        for player in queue.get_players():
+            self.add(player)
+        queue.subscribe(self.on_queue_change)
+
+    def on_queue_change(self, queue: game_queue.Queue, event: str, players: List[game_queue.Player]):
+        if event == game_queue.Queue.ADDED:
+            for player in players:
+                self.add(player)
+        elif event == game_queue.Queue.REMOVED:
+            for player in players:
+                self.remove(player)
+
+    def _ngrams(self, lowered_name: str):
+        for size in range(1, PlayerNameIndex.NGRAM_SIZE + 1):
+            for start in range(len(lowered_name) - size + 1):
+                yield lowered_name[start:start + size]
+
+    def add(self, player: game_queue.Player):
+        entry = id(player)
+        if entry in self.names:
+            self.remove(player)
+        name = player.name
+        self.names[entry] = name
+        self.players[entry] = player
+        lowered_name = name.lower()
+        node = self.trie
+        node["entries"].add(entry)
+        for char in lowered_name:
+            node = node.setdefault(char, {"entries": set()})
+            node["entries"].add(entry)
+        for ngram in self._ngrams(lowered_name):
+            self.ngrams[ngram].add(entry)
+        self.cache.clear()
+
+    def remove(self, player: game_queue.Player):
+        entry = id(player)
+        name = self.names.pop(entry, None)
+        if name is None:
+            return
+        del self.players[entry]
+        lowered_name = name.lower()
+        node = self.trie
+        node["entries"].discard(entry)
+        for char in lowered_name:
+            child = node[char]
+            child["entries"].discard(entry)
+            if len(child["entries"]) == 0:  # Nothing else goes through here, so drop the whole branch
+                del node[char]
+                break
+            node = child
+        for ngram in self._ngrams(lowered_name):
+            self.ngrams[ngram].discard(entry)
+            if len(self.ngrams[ngram]) == 0:
+                del self.ngrams[ngram]
+        self.cache.clear()
+
+    def refresh(self, player: game_queue.Player):
+        """Re-indexes the player if their name changed since they were indexed"""
+        entry = id(player)
+        if entry in self.names and self.names[entry] != player.name:
+            self.add(player)
+
+    def refresh_all(self):
+        for player in list(self.players.values()):
+            self.refresh(player)
+
+    def _prefix_entries(self, query: str) -> Set[int]:
+        node = self.trie
+        for char in query:
+            node = node.get(char)
+            if node is None:
+                return set()
+        return node["entries"]
+
+    def _substring_entries(self, query: str) -> Set[int]:
+        if len(query) <= PlayerNameIndex.NGRAM_SIZE:
+            return self.ngrams.get(query, set())
+        size = PlayerNameIndex.NGRAM_SIZE
+        postings = sorted((self.ngrams.get(query[i:i + size], set()) for i in range(len(query) - size + 1)), key=len)
+        candidates = set.intersection(*postings)
+        return {entry for entry in candidates if query in self.names[entry].lower()}
+
+    def search(self, query: str) -> List[str]:
+        query = query.lower()
+        if query in self.cache:
+            self.cache.move_to_end(query)
+            return self.cache[query]
+
+        prefix_entries = self._prefix_entries(query)
+        results = heapq.nsmallest(PlayerNameIndex.MAX_CHOICES, (self.names[entry] for entry in prefix_entries))
+        if len(results) < PlayerNameIndex.MAX_CHOICES:
+            other_entries = self._substring_entries(query) - prefix_entries
+            results.extend(heapq.nsmallest(PlayerNameIndex.MAX_CHOICES - len(results),
+                                           (self.names[entry] for entry in other_entries)))
+
+        self.cache[query] = results
+        if len(self.cache) > PlayerNameIndex.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return results
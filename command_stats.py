@@ -0,0 +1,178 @@
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict
+import discord
+from discord import app_commands
+import metrics
+import profiler
+
+# The timing below hooks into discord.py internals that are not part of its public API, as they are in discord.py 2.7
+# (pinned in requirements.txt). Check interaction._cs_response, CommandTree._call and View._scheduled_task before
+# upgrading.
+CHECKED_DISCORD_VERSION = (2, 7)
+if tuple(discord.version_info[:2]) != CHECKED_DISCORD_VERSION:
+    logging.warning(f"command_stats was written against discord.py {'.'.join(map(str, CHECKED_DISCORD_VERSION))}, "
+                    f"running {discord.__version__}. Command timing may be wrong or break interaction handling.")
+
+FIRST_RESPONSE_SECONDS = metrics.Histogram("queuebot_interaction_first_response_seconds",
+                                           "Time from starting to handle an interaction to its first response",
+                                           ["command"], buckets=(0.05, 0.1, 0.25, 0.5, 1, 1.5, 2, 2.5, 3, 5, 10))
+HANDLER_SECONDS = metrics.Histogram("queuebot_interaction_handler_seconds",
+                                    "Time taken by interaction handlers from start to finish",
+                                    ["command"], buckets=(0.05, 0.1, 0.25, 0.5, 1, 1.5, 2, 2.5, 3, 5, 10, 30))
+
+
+class TimedInteractionResponse(discord.InteractionResponse):
+    """Calls on_first_response once, as soon as the interaction has been responded to in any way"""
+
+    def __init__(self, parent: discord.Interaction, on_first_response: Callable[[], None]):
+        super().__init__(parent)
+        self.on_first_response = on_first_response
+
+    def _responded(self):
+        if self.on_first_response is not None:
+            on_first_response, self.on_first_response = self.on_first_response, None
+            on_first_response()
+
+    async def defer(self, *args, **kwargs):
+        result = await super().defer(*args, **kwargs)
+        self._responded()
+        return result
+
+    async def send_message(self, *args, **kwargs):
+        result = await super().send_message(*args, **kwargs)
+        self._responded()
+        return result
+
+    async def edit_message(self, *args, **kwargs):
+        result = await super().edit_message(*args, **kwargs)
+        self._responded()
+        return result
+
+    async def send_modal(self, *args, **kwargs):
+        result = await super().send_modal(*args, **kwargs)
+        self._responded()
+        return result
+
+    async def autocomplete(self, *args, **kwargs):
+        result = await super().autocomplete(*args, **kwargs)
+        self._responded()
+        return result
+
+
+class HandlerLatency:
+    SAMPLES = 200
+
+    def __init__(self):
+        self.calls = 0
+        self.slow_calls = 0
+        self.unanswered = 0
+        self.first_responses: deque[float] = deque(maxlen=HandlerLatency.SAMPLES)
+        self.totals: deque[float] = deque(maxlen=HandlerLatency.SAMPLES)
+
+
+class CommandStats:
+    """Latency of every slash command and UI callback: the time until the interaction was first responded to, which
+    Discord wants within 3 seconds, and the time until the handler finished. Calls that took longer than
+    SLOW_CALL_SECONDS to respond are logged."""
+    SLOW_CALL_SECONDS = 2.0
+
+    def __init__(self):
+        self.handlers: Dict[str, HandlerLatency] = {}
+
+    async def time_call(self, interaction: discord.Interaction, run_handler: Callable[[], Awaitable],
+                        get_name: Callable[[], str]) -> Any:
+        started = time.perf_counter()
+        first_response = []
+        # Nothing has looked at interaction.response yet, so the cached response can be swapped for a timed one.
+        # Interaction.response is a cached slot property backed by _cs_response in discord.py 2.7.
+        interaction._cs_response = TimedInteractionResponse(
+            interaction, lambda: first_response.append(time.perf_counter() - started))
+        try:
+            return await run_handler()
+        finally:
+            self.record(get_name(), first_response[0] if len(first_response) > 0 else None,
+                        time.perf_counter() - started)
+
+    def record(self, name: str, first_response: float | None, total: float):
+        latency = self.handlers.get(name)
+        if latency is None:
+            latency = self.handlers[name] = HandlerLatency()
+        latency.calls += 1
+        latency.totals.append(total)
+        HANDLER_SECONDS.observe(total, command=name)
+        if first_response is None:
+            latency.unanswered += 1
+        else:
+            latency.first_responses.append(first_response)
+            FIRST_RESPONSE_SECONDS.observe(first_response, command=name)
+        responded_in = total if first_response is None else first_response
+        if responded_in > CommandStats.SLOW_CALL_SECONDS:
+            latency.slow_calls += 1
+            logging.warning(f"Slow interaction {name}: first response after "
+                            f"{'never' if first_response is None else f'{first_response:.2f}s'}, "
+                            f"handler took {total:.2f}s")
+
+    @staticmethod
+    def _percentiles_str(samples) -> str:
+        if len(samples) == 0:
+            return "-"
+        ordered = sorted(samples)
+        p50 = ordered[len(ordered) // 2]
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return f"{p50 * 1000:.0f}/{p95 * 1000:.0f}/{ordered[-1] * 1000:.0f}ms"
+
+    def stats_str(self) -> str:
+        if len(self.handlers) == 0:
+            return "No interactions handled yet"
+        lines = ["Command: calls, slow, unanswered, first response p50/p95/max, total p50/p95/max"]
+        by_slowest = sorted(self.handlers.items(),
+                            key=lambda item: max(item[1].first_responses, default=0), reverse=True)
+        for name, latency in by_slowest:
+            lines.append(f"{name}: {latency.calls}, {latency.slow_calls}, {latency.unanswered}, "
+                         f"{self._percentiles_str(latency.first_responses)}, "
+                         f"{self._percentiles_str(latency.totals)}")
+        return "\n".join(lines)
+
+
+stats = CommandStats()
+
+
+def get_command_name(interaction: discord.Interaction) -> str:
+    command = interaction.command
+    name = command.qualified_name if command is not None else (interaction.data or {}).get("name", "unknown")
+    if interaction.type is discord.InteractionType.autocomplete:
+        name += " (autocomplete)"
+    return name
+
+
+class TimedCommandTree(app_commands.CommandTree):
+    """Command tree that times every app command and autocomplete it runs"""
+
+    # Overrides the private CommandTree._call of discord.py 2.7, which runs every app command and autocomplete
+    async def _call(self, interaction: discord.Interaction):
+        await stats.time_call(
+            interaction,
+            lambda: profiler.profiler.run(profiler.INTERACTION,
+                                          lambda: super(TimedCommandTree, self)._call(interaction)),
+            lambda: get_command_name(interaction))
+
+
+def get_item_name(item: discord.ui.Item) -> str:
+    # Labels can change (e.g. vote counts), the name of the decorated callback doesn't
+    callback_name = getattr(getattr(item.callback, "callback", None), "__name__", None)
+    return callback_name or getattr(item, "custom_id", None) or type(item).__name__
+
+
+class TimedView(discord.ui.View):
+    """View whose item callbacks are timed like commands, as "<view class>.<callback name>" """
+
+    # Overrides the private View._scheduled_task of discord.py 2.7, which runs an item's checks and callback
+    async def _scheduled_task(self, item: discord.ui.Item, interaction: discord.Interaction):
+        name = f"{type(self).__name__}.{get_item_name(item)}"
+        await stats.time_call(
+            interaction,
+            lambda: profiler.profiler.run(profiler.INTERACTION,
+                                          lambda: super(TimedView, self)._scheduled_task(item, interaction)),
+            lambda: name)
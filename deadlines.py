@@ -0,0 +1,72 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+DeadlineCallback = Callable[[], Awaitable]
+
+
+class DeadlineScheduler:
+    """Runs callbacks when their deadlines pass, using a heap of deadlines and a single sleeper task.
+
+    Each key (e.g. a room) has a set of pending events. Scheduling a key again replaces its pending events: the old heap
+    entries are not searched for, they are skipped when they reach the top of the heap because their generation is
+    out of date. Generations are never reused, even across keys, so a key that is cancelled and scheduled again
+    doesn't bring its old entries back. Scheduling and cancelling are O(log n) and the sleeper only wakes up when an
+    event is due, or when an earlier deadline is scheduled."""
+
+    def __init__(self):
+        self.heap: List[Tuple[datetime.datetime, int, Any, int, DeadlineCallback]] = []
+        self.generations: Dict[Any, int] = {}
+        self.generation_counter = itertools.count(1)
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.sleeper: asyncio.Task | None = None
+
+    def start(self):
+        if self.sleeper is None or self.sleeper.done():
+            self.sleeper = asyncio.create_task(self._run())
+
+    def schedule(self, key: Any, events: List[Tuple[datetime.datetime, DeadlineCallback]]):
+        """Replaces the pending events of key with the given (deadline, callback) pairs"""
+        generation = self.generations[key] = next(self.generation_counter)
+        for deadline, callback in events:
+            heapq.heappush(self.heap, (deadline, next(self.sequence), key, generation, callback))
+        self.wakeup.set()
+
+    def cancel(self, key: Any):
+        self.generations.pop(key, None)
+
+    def is_current(self, key: Any, generation: int) -> bool:
+        return self.generations.get(key) == generation
+
+    def pending_count(self) -> int:
+        return sum(1 for _, _, key, generation, _ in self.heap if self.is_current(key, generation))
+
+    async def _run(self):
+        while True:
+            while len(self.heap) > 0 and not self.is_current(self.heap[0][2], self.heap[0][3]):
+                heapq.heappop(self.heap)
+            self.wakeup.clear()
+            if len(self.heap) == 0:
+                await self.wakeup.wait()
+                continue
+            delay = (self.heap[0][0] - datetime.datetime.now()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, key, _, callback = heapq.heappop(self.heap)
+            asyncio.create_task(self._fire(key, callback))
+
+    @staticmethod
+    async def _fire(key: Any, callback: DeadlineCallback):
+        try:
+            await callback()
+        except Exception as e:
+            logging.critical(f"Exception occurred in deadline callback for {key}:")
+            logging.exception(e)
@@ -4,10 +4,12 @@ from discord.ext import commands
 import re
 import pickle
 import logging
+import persistence
 
 from typing import Literal, Dict, Tuple
 
 FC_MAP = {}
+FC_DATA_FILE = "fc_data_pkl"
 
 
 def is_fc(fc: str):
@@ -54,18 +56,39 @@ async def setup(bot):
     await bot.add_cog(FCCog(bot))
 
 
+def get_save_snapshot():
+    return {"FC_MAP": dict(FC_MAP)}
+
+
 def save_data():
-    to_dump = {"FC_MAP": FC_MAP}
-    with open("fc_data_pkl", "wb") as f:
-        pickle.dump(to_dump, f)
+    """Schedules FC_MAP to be written to disk in the background"""
+    persistence.writer.mark_dirty(FC_DATA_FILE)
+
+
+persistence.writer.register(FC_DATA_FILE, get_save_snapshot)
+
+
+def read_data():
+    """Reads the saved FC data without applying it. Safe to call from a worker thread."""
+    try:
+        with open(FC_DATA_FILE, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:  # Nothing saved yet, there's nothing to lose by writing it
+        return {"FC_MAP": {}}
+    except Exception as e:
+        logging.critical("Failed to load fc pickle:")
+        logging.critical(e)
 
 
-def load_data():
+def apply_data(to_load: dict | None):
+    """Applies read_data's result. The FC file is only written afterwards if this succeeded."""
+    if to_load is None:
+        return
     try:
-        with open("fc_data_pkl", "rb") as f:
-            to_load = pickle.load(f)
-            FC_MAP.clear()
-            FC_MAP.update(to_load["FC_MAP"])
+        FC_MAP.clear()
+        FC_MAP.update(to_load["FC_MAP"])
     except Exception as e:
         logging.critical("Failed to load fc pickle:")
         logging.critical(e)
+        return
+    persistence.writer.mark_loaded(FC_DATA_FILE)
@@ -1,8 +1,13 @@
 import datetime
-from typing import List, Tuple
+import logging
+from typing import List, Tuple, Callable
 import discord
+import metrics
 import shared
 
+QUEUE_EVENTS = metrics.Counter("queuebot_queue_events_total", "Changes made to the queues", ["event"])
+
+
 class QueueExceptions(Exception):
     pass
 
@@ -44,15 +49,29 @@ class Player:
                 return self.discord_member.display_name
         return self._name
 
-    def update_activity(self):
-        self.last_active = datetime.datetime.now()
+    def update_activity(self, when: datetime.datetime = None):
+        self.last_active = datetime.datetime.now() if when is None else when
         self.drop_warned = False
 
     def get_queue_key(self):
         return shared.utf8_to_ascii_mapping_name_fix(self.name)
 
-    def prepare_save(self):
-        self.discord_member = None
+    def to_record(self) -> dict:
+        """Returns a plain copy of this player for saving. Never touches the discord member."""
+        return {"name": self.name,
+                "mmr": self.mmr,
+                "lr": self.lr,
+                "time_queued": self.time_queued,
+                "can_host": self.can_host,
+                "drop_warned": self.drop_warned,
+                "queue_channel_id": self.queue_channel_id,
+                "discord_id": self.discord_id,
+                "last_active": self.last_active}
+
+    @staticmethod
+    def from_record(record: dict) -> 'Player':
+        """Creates a player from to_record's output. The discord member is attached afterwards with reload."""
+        return Player(discord_member=None, **record)
 
     def reload(self, guild: discord.Guild):
         self.discord_member = guild.get_member(self.discord_id)
@@ -100,21 +119,28 @@ class Player:
 
 class Group(list):
     MAX_PLAYERS = 12
+    # Class level default so groups unpickled from older saves (which never ran __init__) still have a version
+    version = 0
 
     def __init__(self, iterable):
         if len(iterable) > Group.MAX_PLAYERS:
             raise TooManyPlayers()
         super().__init__(iterable)
 
+    def _changed(self):
+        self.version += 1
+
     def append(self, player: Player):
         if (len(self) + 1) > Group.MAX_PLAYERS:
             raise TooManyPlayers()
         super().append(player)
+        self._changed()
 
     def insert(self, index, item):
         if (len(self) + 1) > Group.MAX_PLAYERS:
             raise TooManyPlayers()
         super().insert(index, item)
+        self._changed()
 
     def add_singleton(self, group: 'Group'):
         if len(group) != 1:
@@ -123,6 +149,7 @@ class Group(list):
             raise TooManyPlayers()
         self.extend(group)
         group.clear()
+        group._changed()
 
     def extend(self, group: 'Group'):
         if not isinstance(group, list):
@@ -130,11 +157,13 @@ class Group(list):
         if (len(self) + len(group)) > Group.MAX_PLAYERS:
             raise TooManyPlayers()
         super().extend(group)
+        self._changed()
 
     def remove(self, player: Player):
         found_player = self.get(player)
         if found_player is not None:
             super().remove(found_player)
+            self._changed()
         return found_player
 
     def get(self, player: Player):
@@ -147,38 +176,124 @@ class Group(list):
     def __contains__(self, player: Player):
         return any(p.get_queue_key() == player.get_queue_key() for p in self)
 
-    def prepare_save(self):
-        for player in self:
-            player.prepare_save()
+    def to_record(self) -> List[dict]:
+        return [player.to_record() for player in self]
 
-    def reload(self, guild: discord.Guild):
+    @staticmethod
+    def from_record(record: List[dict]) -> 'Group':
+        return Group([Player.from_record(player_record) for player_record in record])
+
+    def reload(self, guild: discord.Guild) -> List[Player]:
         for player in self:
             player.reload(guild)
-        self.remove_empty_players()
+        return self.remove_empty_players()
 
-    def remove_empty_players(self):
+    def remove_empty_players(self) -> List[Player]:
+        """Removes players whose discord member could not be found and returns them"""
         to_remove = []
         for i in range(len(self)):
             if self[i].discord_member is None:
                 to_remove.append(i)
-        for j in reversed(to_remove):
-            self.pop(j)
+        removed = [self.pop(j) for j in reversed(to_remove)]
+        if len(removed) > 0:
+            self._changed()
+        return removed
 
     def can_add_player(self):
         return (len(self) + 1) <= Group.MAX_PLAYERS
 
 
+QueueListener = Callable[['Queue', str, List[Player]], None]
+
+
 class Queue(list):
+    """The players queued for a ladder, stored as a list of groups.
+
+    Every mutation made through the methods below increments version and notifies the subscribed listeners with
+    listener(queue, event, players), where event is one of the event constants and players are the players affected.
+    Code outside this class should not mutate the queue or its groups directly, otherwise listeners miss the change."""
+    ADDED = "added"
+    REMOVED = "removed"
+    MERGED = "merged"
+    SPLINTERED = "splintered"
+    RATINGS_UPDATED = "ratings updated"
+    HOST_UPDATED = "host updated"
+
+    version = 0
+    _discord_id_index = {}
+    _discord_id_index_version = None
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._listeners: List[QueueListener] = []
+
+    def __getstate__(self):
+        # Listeners are live callbacks and should never end up in a save
+        state = self.__dict__.copy()
+        state.pop("_listeners", None)
+        state.pop("_discord_id_index", None)
+        state.pop("_discord_id_index_version", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._listeners = []
+
+    def subscribe(self, listener: QueueListener):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener: QueueListener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, event: str, players: List[Player]):
+        self.version += 1
+        QUEUE_EVENTS.inc(event=event)
+        for listener in list(self._listeners):
+            try:
+                listener(self, event, players)
+            except Exception as e:
+                logging.critical(f"Queue listener failed on '{event}' event:")
+                logging.exception(e)
+
+    def load(self, groups: List[Group]):
+        """Replaces everything in the queue with the given groups"""
+        removed = self.get_players()
+        self.clear()
+        if len(removed) > 0:
+            self._notify(Queue.REMOVED, removed)
+        self.extend(groups)
+        self.remove_empty_groups()
+        added = self.get_players()
+        if len(added) > 0:
+            self._notify(Queue.ADDED, added)
 
     def add_to_queue(self, player: Player):
         self.append(Group([player]))
+        self._notify(Queue.ADDED, [player])
 
     def splinter_from_group(self, player: Player):
         for group in self:
             if player in group:
-                self.append(Group([group.remove(player)]))  # Remove player from group and put in their own group
+                splintered = group.remove(player)
+                self.append(Group([splintered]))  # Remove player from group and put in their own group
+                self.remove_empty_groups()
+                self._notify(Queue.SPLINTERED, [splintered])
                 break
+
+    def merge_into_group(self, group: Group, player: Player):
+        """Moves the given player out of their current group and into the given group. Returns the moved player."""
+        if not group.can_add_player():
+            raise TooManyPlayers()
+        current_group = self.get_group(player)
+        if current_group is None or current_group is group:
+            return None
+        moved = current_group.remove(player)
+        group.append(moved)
         self.remove_empty_groups()
+        self._notify(Queue.MERGED, [moved])
+        return moved
 
     def remove_from_queue(self, player: Player):
         removed = None
@@ -186,8 +301,29 @@ class Queue(list):
             if player in group:
                 removed = group.remove(player)
         self.remove_empty_groups()
+        if removed is not None:
+            self._notify(Queue.REMOVED, [removed])
         return removed
 
+    def set_host(self, player: Player, can_host: bool):
+        queued_player = self.get_player(player)
+        if queued_player is not None and queued_player.can_host != can_host:
+            queued_player.can_host = can_host
+            self._notify(Queue.HOST_UPDATED, [queued_player])
+        return queued_player
+
+    def update_ratings(self, get_rating: Callable[[Player], Tuple[int, int] | None]):
+        """Sets the mmr and lr of each queued player to get_rating(player), which returns (mmr, lr) or None"""
+        updated = []
+        for player in self.get_players():
+            player_rating = get_rating(player)
+            if player_rating is not None and (player.mmr, player.lr) != player_rating:
+                player.mmr, player.lr = player_rating
+                updated.append(player)
+        if len(updated) > 0:
+            self._notify(Queue.RATINGS_UPDATED, updated)
+        return updated
+
     def player_in_queue(self, player: Player) -> bool:
         """Returns if a given player is in the queue or not"""
         return any(lambda g: player in g, self)
@@ -200,14 +336,21 @@ class Queue(list):
         for j in reversed(to_remove):
             self.pop(j)
 
-    def prepare_save(self):
-        for group in self:
-            group.prepare_save()
+    def to_records(self) -> List[List[dict]]:
+        """Returns plain copies of the queued groups for saving. Leaves the queue and its players untouched."""
+        return [group.to_record() for group in self]
+
+    @staticmethod
+    def groups_from_records(records: List[List[dict]]) -> List[Group]:
+        return [Group.from_record(record) for record in records]
 
     def reload(self, guild:discord.Guild):
+        removed = []
         for group in self:
-            group.reload(guild)
+            removed.extend(group.reload(guild))
         self.remove_empty_groups()
+        if len(removed) > 0:
+            self._notify(Queue.REMOVED, removed)
 
     def __contains__(self, player: Player):
         return any(player in group for group in self)
@@ -222,6 +365,20 @@ class Queue(list):
             if player in group:
                 return group
 
+    def get_players_by_discord_id(self, discord_id: int) -> List[Player]:
+        """O(1) lookup of the queued players with the given discord id. The index is rebuilt at most once per change
+        to the queue."""
+        if self._discord_id_index_version != self.version:
+            index = {}
+            for player in self.get_players():
+                index.setdefault(player.discord_id, []).append(player)
+            self._discord_id_index = index
+            self._discord_id_index_version = self.version
+        return self._discord_id_index.get(discord_id, [])
+
+    def has_discord_id(self, discord_id: int) -> bool:
+        return len(self.get_players_by_discord_id(discord_id)) > 0
+
     def get_players(self) -> List[Player]:
         players = []
         for group in self:
@@ -0,0 +1,109 @@
+import datetime
+from typing import Dict, Iterable, List, Set
+import algorithm
+import autocomplete
+import game_queue
+import queue_board
+import rating
+import shared
+
+
+class Ladder:
+    """Everything that belongs to one ladder: its queue and the indexes built on it, the channels players queue for it
+    in, the category its rooms are made under, its rating table and its matchmaking settings. Ladders share no state,
+    so each one's matchmaking runs on its own."""
+
+    def __init__(self, name: str, score_threshold: float = algorithm.SCORE_THRESHOLD, article: str = "a"):
+        self.name = name
+        # Lineups need at least this score to form a room
+        self.score_threshold = score_threshold
+        # "a" or "an", whichever goes before the spelled out name, e.g. "an RT event"
+        self.article = article
+        self.queue = game_queue.Queue()
+        self.queue_channels: Set[int] = set()
+        self.category_id: int | None = None
+        self.name_index = autocomplete.PlayerNameIndex(self.queue)
+        self.board = queue_board.QueueBoard(self.queue, name)
+        # Queue version at the end of the last lineup search
+        self.last_formation_version = None
+        # Best lineup score found by the last lineup search, and whether the status messages still need to show it
+        self.best_score: float | None = None
+        self.status_stale = False
+        self.last_room_formed: datetime.datetime | None = None
+        # Last message time of queued players by discord id, applied to the players by flush_player_activity
+        self.pending_activity: Dict[int, datetime.datetime] = {}
+
+    @property
+    def rating_table(self) -> dict:
+        return rating.get_mmr_data(self.name)
+
+    def to_record(self) -> dict:
+        return {"queue_channels": set(self.queue_channels),
+                "queue": self.queue.to_records(),
+                "category_id": self.category_id,
+                "last_room_formed": self.last_room_formed}
+
+    def load(self, queue_channels: Iterable[int], groups: List[game_queue.Group], category_id: int | None,
+             last_room_formed: datetime.datetime | None):
+        self.queue_channels.clear()
+        self.queue_channels.update(queue_channels)
+        self.queue.load(groups)
+        self.category_id = category_id
+        self.last_room_formed = last_room_formed
+        self.last_formation_version = None
+        reindex_channels()
+
+
+LADDERS: Dict[str, Ladder] = {}
+# Every queue channel of every ladder, kept in sync through add_queue_channel, remove_queue_channel and Ladder.load
+_ladders_by_channel: Dict[int, Ladder] = {}
+
+
+def register(ladder: Ladder) -> Ladder:
+    LADDERS[ladder.name] = ladder
+    reindex_channels()
+    return ladder
+
+
+def get(name: str) -> Ladder | None:
+    return LADDERS.get(name)
+
+
+def get_all() -> List[Ladder]:
+    return list(LADDERS.values())
+
+
+def get_by_channel(channel_id: int) -> Ladder | None:
+    return _ladders_by_channel.get(channel_id)
+
+
+def get_by_queue(queue: game_queue.Queue) -> Ladder | None:
+    for ladder in LADDERS.values():
+        if ladder.queue is queue:
+            return ladder
+
+
+def reindex_channels():
+    _ladders_by_channel.clear()
+    for ladder in LADDERS.values():
+        for channel_id in ladder.queue_channels:
+            _ladders_by_channel[channel_id] = ladder
+
+
+def add_queue_channel(ladder: Ladder, channel_id: int):
+    ladder.queue_channels.add(channel_id)
+    _ladders_by_channel[channel_id] = ladder
+    # Make the next lineup search put up the status message in the new channel
+    ladder.last_formation_version = None
+
+
+def remove_queue_channel(channel_id: int) -> Ladder | None:
+    """Stops queueing in the channel. Returns the ladder it was a queue channel of, if any."""
+    ladder = _ladders_by_channel.pop(channel_id, None)
+    if ladder is not None:
+        ladder.queue_channels.discard(channel_id)
+    return ladder
+
+
+register(Ladder(shared.RT_LADDER, article="an"))
+register(Ladder(shared.CT_LADDER))
@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+import metrics
+
+LOOP_LAG_SECONDS = metrics.Histogram("queuebot_event_loop_lag_seconds",
+                                     "How late the event loop ran the lag monitor's heartbeat",
+                                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+LOOP_STALLS = metrics.Counter("queuebot_event_loop_stalls_total",
+                              "Times the event loop was blocked for longer than the stall threshold")
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stall:
+    def __init__(self, location: str, stack: str):
+        self.location = location
+        self.stack = stack
+        self.detected_at = datetime.datetime.now()
+        self.lag: float | None = None
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a heartbeat scheduled every INTERVAL seconds, and finds out what blocked
+    it.
+
+    A watchdog thread checks that the heartbeat keeps running. When it is more than STALL_SECONDS late, the loop is
+    blocked by synchronous code, so the watchdog takes the loop thread's current stack and blames the innermost frame
+    of the bot's own code. is_lagging reports whether the recent lag is high enough that non-essential work should be
+    put off."""
+    INTERVAL = 0.5
+    STALL_SECONDS = 0.25
+    HIGH_LAG_SECONDS = 0.25
+    SAMPLES = 1200  # 10 minutes of heartbeats
+    RECENT_SAMPLES = 20
+    STALL_HISTORY = 10
+    STACK_DEPTH = 8
+
+    def __init__(self):
+        self.samples: deque[float] = deque(maxlen=LoopLagMonitor.SAMPLES)
+        self.stalls: deque[Stall] = deque(maxlen=LoopLagMonitor.STALL_HISTORY)
+        self.culprits: Counter[str] = Counter()
+        self.last_beat = time.monotonic()
+        self.current_stall: Stall | None = None
+        self.stall_lock = threading.Lock()
+        self.loop_thread_id: int | None = None
+        self.heartbeat: asyncio.Task | None = None
+        self.watchdog: threading.Thread | None = None
+
+    def start(self):
+        """Starts monitoring the running event loop. Must be called from the loop's thread."""
+        if self.heartbeat is not None and not self.heartbeat.done():
+            return
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.heartbeat = asyncio.create_task(self._beat())
+        if self.watchdog is None:
+            self.watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+            self.watchdog.start()
+
+    async def _beat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LoopLagMonitor.INTERVAL
+            await asyncio.sleep(LoopLagMonitor.INTERVAL)
+            lag = max(0.0, loop.time() - expected)
+            self.last_beat = time.monotonic()
+            self.samples.append(lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            with self.stall_lock:
+                stall, self.current_stall = self.current_stall, None
+            if stall is not None:
+                stall.lag = lag
+                self.stalls.append(stall)
+                self.culprits[stall.location] += 1
+                LOOP_STALLS.inc()
+                logging.warning(f"Event loop was blocked for {lag:.2f}s in {stall.location}:\n{stall.stack}")
+
+    def _watch(self):
+        while True:
+            time.sleep(LoopLagMonitor.INTERVAL / 2)
+            overdue = time.monotonic() - self.last_beat - LoopLagMonitor.INTERVAL
+            if overdue < LoopLagMonitor.STALL_SECONDS:
+                continue
+            with self.stall_lock:
+                if self.current_stall is not None:
+                    continue
+                frame = sys._current_frames().get(self.loop_thread_id)
+                if frame is not None:
+                    self.current_stall = self._describe(frame)
+
+    @staticmethod
+    def _describe(frame) -> Stall:
+        stack = traceback.extract_stack(frame)
+        is_own = [summary.filename.startswith(PROJECT_DIRECTORY) and summary.filename != __file__
+                  for summary in stack]
+        blamed_index = max((i for i, own in enumerate(is_own) if own), default=len(stack) - 1)
+        blamed = stack[blamed_index]
+        location = f"{os.path.basename(blamed.filename)}:{blamed.lineno} in {blamed.name}"
+        # Only show the bot's own calls that led to the blamed frame, the event loop's frames above them are the same
+        # for every stall
+        start = blamed_index
+        while start > 0 and is_own[start - 1]:
+            start -= 1
+        return Stall(location, "".join(traceback.format_list(stack[start:][-LoopLagMonitor.STACK_DEPTH:])))
+
+    @staticmethod
+    def _percentile(ordered, fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def is_lagging(self) -> bool:
+        recent = list(self.samples)[-LoopLagMonitor.RECENT_SAMPLES:]
+        return len(recent) > 0 and max(recent) > LoopLagMonitor.HIGH_LAG_SECONDS
+
+    def stats_str(self) -> str:
+        if len(self.samples) == 0:
+            return "No event loop lag samples yet"
+        ordered = sorted(self.samples)
+        lines = [f"Event loop lag over the last {len(ordered)} heartbeats: "
+                 f"p50 {self._percentile(ordered, 0.5) * 1000:.1f}ms, "
+                 f"p95 {self._percentile(ordered, 0.95) * 1000:.1f}ms, "
+                 f"p99 {self._percentile(ordered, 0.99) * 1000:.1f}ms, max {ordered[-1] * 1000:.1f}ms",
+                 f"Lagging right now: {'yes' if self.is_lagging() else 'no'}"]
+        if len(self.culprits) > 0:
+            lines.append("Most frequent causes of stalls:")
+            lines.extend(f"{count}x {location}" for location, count in self.culprits.most_common(5))
+        if len(self.stalls) > 0:
+            stall = self.stalls[-1]
+            lines.append(f"Last stall, {stall.lag:.2f}s at {stall.detected_at:%H:%M:%S}:\n```\n{stall.stack}```")
+        return "\n".join(lines)
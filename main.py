@@ -1,5 +1,12 @@
 import asyncio
+import command_stats
+import hashlib
+import ladders
+import json
 import random
+import signal
+import sys
+import time
 from typing import Literal, Dict, Tuple, List, Optional, Union, Any
 import discord
 from discord import app_commands, ui
@@ -7,65 +14,152 @@ from discord.ext import commands, tasks
 
 import game_queue
 from config import TOKEN
-import simulation
 import shared
 import rating
+import teams
 import logging
+import loop_lag
 import datetime
+import deadlines
 import pickle
 import algorithm
 import fc_commands
 from collections import defaultdict
-import itertools
-import test_rooms
-import unittest
+import matchmaking
+import memory_report
+import metrics
+import outbound
+import persistence
+import profiler
+import room_channels
+import room_permissions
+import simulation
+import status_messages
+import tick_budget
+
 
-bot = commands.Bot(command_prefix="!", intents=discord.Intents.all())
+class QueueBot(commands.Bot):
+    async def setup_hook(self):
+        # Stop on SIGTERM (e.g. a service restart) the same way as on Ctrl+C, so close runs and the data is saved
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+        except NotImplementedError:  # Windows
+            pass
 
-RT_QUEUE_CATEGORY = None
-CT_QUEUE_CATEGORY = None
-RT_QUEUE_CHANNELS = set()
-CT_QUEUE_CHANNELS = set()
+    async def close(self):
+        # Runs twice on SIGTERM, once from the signal and again when bot.run exits. Only the first call saves.
+        try:
+            await persistence.writer.close()
+        except Exception as e:
+            logging.critical("Failed to save data while shutting down:")
+            logging.exception(e)
+        await super().close()
+
+
+process_started = time.perf_counter()
+bot = QueueBot(command_prefix="!", intents=discord.Intents.all(), tree_cls=command_stats.TimedCommandTree)
+outbound_dispatcher = outbound.MessageDispatcher(bot)
+queue_status_board = status_messages.StatusMessageBoard(outbound_dispatcher, lambda: mark_main_data_dirty())
+routine_budget = tick_budget.TickBudget("run_routines", shared.ROUTINE_TICK_BUDGET)
+metrics_server = metrics.MetricsServer("127.0.0.1", shared.METRICS_PORT)
+loop_lag_monitor = loop_lag.LoopLagMonitor()
+if shared.SHED_ON_LOOP_LAG:
+    routine_budget.add_shed_condition(loop_lag_monitor.is_lagging)
+
+QUEUE_PLAYERS = metrics.Gauge("queuebot_queue_players", "Players in each queue", ["ladder"])
+BEST_LINEUP_SCORE = metrics.Gauge("queuebot_best_lineup_score", "Score of the best lineup found by the last search",
+                                  ["ladder"])
+ACTIVE_ROOMS = metrics.Gauge("queuebot_active_rooms", "Rooms that haven't expired yet")
+ROOMS_FORMED = metrics.Counter("queuebot_rooms_formed_total", "Rooms formed from the queues", ["ladder"])
+MATCHMAKING_SECONDS = metrics.Histogram("queuebot_matchmaking_seconds",
+                                        "Time taken by a lineup search, including starting the rooms it formed",
+                                        ["ladder"])
+ROUTINE_TICK_SECONDS = metrics.Histogram("queuebot_routine_tick_seconds", "Time taken by a run of the routines")
+ROUTINE_STAGE_SECONDS = metrics.Histogram("queuebot_routine_stage_seconds",
+                                          "Time taken by each stage of the routines", ["stage"])
+ROUTINE_STAGES_DEFERRED = metrics.Counter("queuebot_routine_stages_deferred_total",
+                                          "Non-critical stages of the routines put off because a tick was over budget",
+                                          ["stage"])
 
 finished_on_ready = False
 rooms = []
+# Index of the rooms above that have a channel, by channel id. Keep it in sync through index_room and unindex_room.
+rooms_by_channel: Dict[int, 'Room'] = {}
 to_restart = []
 
-RT_QUEUE = game_queue.Queue()
-CT_QUEUE = game_queue.Queue()
+LADDER_CHOICES = [app_commands.Choice(name=ladder.name, value=ladder.name) for ladder in ladders.get_all()]
+for _ladder in ladders.get_all():
+    QUEUE_PLAYERS.set_function(_ladder.queue.count_players_queued, ladder=_ladder.name)
+    BEST_LINEUP_SCORE.set_function(lambda ladder=_ladder: ladder.best_score, ladder=_ladder.name)
+ACTIVE_ROOMS.set_function(lambda: len(rooms))
 
-def channel_is_free(channel_id: int):
-    if channel_id is None:
-        return False
-    return all(r.room_channel_id != channel_id for r in rooms)
+memory_reporter = memory_report.MemoryReporter()
+for _ladder in ladders.get_all():
+    memory_reporter.register(f"{_ladder.name} rating table", lambda ladder=_ladder: ladder.rating_table)
+    memory_reporter.register(f"{_ladder.name} queue",
+                             lambda ladder=_ladder: (ladder.queue, ladder.name_index, ladder.board,
+                                                     ladder.pending_activity))
+memory_reporter.register("rooms", lambda: rooms)
+memory_reporter.register("FC_MAP", lambda: fc_commands.FC_MAP)
+if shared.TRACE_MEMORY_AT_STARTUP:
+    memory_reporter.start_tracing()
+
+
+def index_room(room: 'Room'):
+    if room.room_channel_id is not None:
+        rooms_by_channel[room.room_channel_id] = room
+
+
+def unindex_room(room: 'Room'):
+    if rooms_by_channel.get(room.room_channel_id) is room:
+        rooms_by_channel.pop(room.room_channel_id)
+
+
+def reindex_rooms():
+    rooms_by_channel.clear()
+    for room in rooms:
+        index_room(room)
+
+
+def get_room(channel_id: int) -> Optional['Room']:
+    return rooms_by_channel.get(channel_id)
+
+
+room_channel_pool = room_channels.RoomChannelPool()
+room_permission_manager = room_permissions.PermissionManager()
+
+
+def rebuild_room_channel_pool():
+    categories = {}
+    for category_id in (ladder.category_id for ladder in ladders.get_all()):
+        category_channel = None if category_id is None else bot.get_channel(category_id)
+        if category_channel is not None:
+            categories[category_id] = [channel.id for channel in category_channel.text_channels]
+    room_channel_pool.rebuild(categories, (r.room_channel_id for r in rooms if r.room_channel_id is not None))
 
 class QueueingNotAllowedInChannel(discord.app_commands.AppCommandError):
     pass
 
+def get_ladder(ladder_type: str | int) -> ladders.Ladder | None:
+    """Finds a ladder by its name or by one of its queue channels"""
+    if isinstance(ladder_type, str):
+        return ladders.get(ladder_type)
+    return ladders.get_by_channel(ladder_type)
+
 def get_queue(ladder_type: str | int):
-    if ladder_type == shared.RT_LADDER:
-        return RT_QUEUE
-    elif ladder_type == shared.CT_LADDER:
-        return CT_QUEUE
-    elif ladder_type in RT_QUEUE_CHANNELS:
-        return RT_QUEUE
-    elif ladder_type in CT_QUEUE_CHANNELS:
-        return CT_QUEUE
+    ladder = get_ladder(ladder_type)
+    return None if ladder is None else ladder.queue
 
 def get_queue_and_ladder(ladder_type: str | int):
-    queue = get_queue(ladder_type)
-    if queue is None:
+    ladder = get_ladder(ladder_type)
+    if ladder is None:
         raise QueueingNotAllowedInChannel("Queueing not allowed in this channel")
-    ladder_type = shared.RT_LADDER if queue is RT_QUEUE else shared.CT_LADDER
-    return queue, ladder_type
+    return ladder.queue, ladder.name
 
 
 
 def get_queue_channels(ladder_type: str):
-    if ladder_type == shared.RT_LADDER:
-        return RT_QUEUE_CHANNELS
-    elif ladder_type == shared.CT_LADDER:
-        return CT_QUEUE_CHANNELS
+    return ladders.get(ladder_type).queue_channels
 
 
 class Room:
@@ -73,6 +167,10 @@ class Room:
     ROOM_WARN_TIME = datetime.timedelta(minutes=3)
     ROOM_EXTENSION_TIME = datetime.timedelta(minutes=5)
     MAX_ROOM_ACCESS_TIME = datetime.timedelta(minutes=6)
+    # Seconds that balancing 2v2, 3v3 and 4v4 teams may block the event loop for
+    TEAM_BALANCING_TIME_BUDGET = 0.05
+    # Difference between the highest and lowest team MMR totals. Class level default for rooms saved before it existed.
+    team_spread = None
 
     def __init__(self, players: List[game_queue.Player], ladder_type: str):
         self.players = list(players)
@@ -84,6 +182,7 @@ class Room:
         self.expiration_time = self.start_time + Room.ROOM_EXPIRATION_TIME
         self.expiration_warning_sent = False
         self.teams: List[List[game_queue.Player]] = None
+        self.team_spread: int | None = None
         self.finished = False
         self.host_str = "No one queued as a host."
 
@@ -91,9 +190,49 @@ class Room:
         self.changed_visibility = False
         self.finished_start = False
 
+    def to_record(self) -> dict:
+        """Returns a plain copy of this room for saving. Teams are saved as indexes into players."""
+        player_indexes = {id(p): i for i, p in enumerate(self.players)}
+        return {"players": [p.to_record() for p in self.players],
+                "ladder_type": self.ladder_type,
+                "room_channel_id": self.room_channel_id,
+                "winning_vote": self.winning_vote,
+                "votes": {vote: set(voters) for vote, voters in self.votes.items()},
+                "start_time": self.start_time,
+                "expiration_time": self.expiration_time,
+                "expiration_warning_sent": self.expiration_warning_sent,
+                "teams": None if self.teams is None else [[player_indexes[id(p)] for p in team] for team in self.teams],
+                "team_spread": self.team_spread,
+                "finished": self.finished,
+                "host_str": self.host_str,
+                "changed_visibility": self.changed_visibility,
+                "finished_start": self.finished_start}
+
+    @staticmethod
+    def from_record(record: dict, guild: discord.Guild | None) -> 'Room':
+        players = [game_queue.Player.from_record(player_record) for player_record in record["players"]]
+        if guild is not None:
+            for player in players:
+                player.reload(guild)
+        room = Room(players, record["ladder_type"])
+        room.room_channel_id = record["room_channel_id"]
+        room.winning_vote = record["winning_vote"]
+        room.votes = record["votes"]
+        room.start_time = record["start_time"]
+        room.expiration_time = record["expiration_time"]
+        room.expiration_warning_sent = record["expiration_warning_sent"]
+        if record["teams"] is not None:
+            room.teams = [[players[i] for i in team] for team in record["teams"]]
+        room.team_spread = record["team_spread"]
+        room.finished = record["finished"]
+        room.host_str = record["host_str"]
+        room.changed_visibility = record["changed_visibility"]
+        room.finished_start = record["finished_start"]
+        return room
+
     def get_category_channel(self) -> discord.CategoryChannel | None:
-        category_id = RT_QUEUE_CATEGORY if self.ladder_type == shared.RT_LADDER else CT_QUEUE_CATEGORY
-        return bot.get_channel(category_id)
+        category_id = ladders.get(self.ladder_type).category_id
+        return None if category_id is None else bot.get_channel(category_id)
 
     def get_room_channel(self) -> discord.TextChannel | None:
         return bot.get_channel(self.room_channel_id)
@@ -110,6 +249,8 @@ class Room:
     def extend_(self):
         self.expiration_time = self.expiration_time + Room.ROOM_EXTENSION_TIME
         self.expiration_warning_sent = False
+        schedule_room_deadlines(self)
+        mark_main_data_dirty()
 
     def is_expired(self) -> bool:
         return datetime.datetime.now() > self.expiration_time
@@ -124,18 +265,8 @@ class Room:
                 f"**Players will lose access to this channel in {int(Room.ROOM_WARN_TIME.seconds / 60)} minutes.** Use slash command `/extend` for a {int(Room.ROOM_EXTENSION_TIME.seconds / 60)} minute extension.")
 
     def make_even_teams(self, lineup, num_teams=2):
-        """Brute forces all combinations of teams. Be careful... 12 choose 6 = 954, which is OK"""
-        lineup = set(lineup)
-        self.teams = []
-
-        def difference_of_sums(team):
-            team = set(team)
-            second_team = lineup.difference(team)
-            return abs(sum(algorithm.get_mmr(p1) for p1 in team) - sum(algorithm.get_mmr(p2) for p2 in second_team))
-
-        most_even_team = min(itertools.combinations(lineup, len(lineup) // num_teams), key=difference_of_sums)
-        self.teams.append(list(most_even_team))
-        self.teams.append(list(lineup.difference(most_even_team)))
+        """Splits the lineup into the two teams with the smallest possible difference in total MMR"""
+        self.teams = list(teams.split_even_halves(lineup, key=algorithm.get_mmr))
 
     def make_teams(self):
         lineup = self.players[:algorithm.LINEUP_SIZE]
@@ -145,9 +276,14 @@ class Room:
         self.teams = []
         if self.winning_vote == "6v6":
             self.make_even_teams(lineup)
-        else:
+        elif step == 1:
             for i in range(0, len(lineup), step):
                 self.teams.append(lineup[i:i + step])
+        else:
+            self.teams, self.team_spread = teams.make_balanced_teams(lineup, step, key=algorithm.get_mmr,
+                                                                     time_budget=Room.TEAM_BALANCING_TIME_BUDGET)
+            logging.info(f"Made {self.winning_vote} teams for {self.ladder_type.upper()} room in "
+                         f"{self.room_channel_id} with a team MMR spread of {self.team_spread}")
         self.teams.sort(key=get_team_average_mmr, reverse=True)
 
     def randomize_host(self):
@@ -195,6 +331,7 @@ class Room:
 
         await self.change_player_visibility(view=True)
         self.changed_visibility = True
+        mark_main_data_dirty()
         await self.cast_vote()
 
     async def after_vote(self, winning_vote, votes):
@@ -204,6 +341,7 @@ class Room:
         self.randomize_host()
         await self.send_teams_at_start()
         self.finished_start = True
+        mark_main_data_dirty()
 
     async def send_vote_notification(self):
         await self.get_room_channel().send(
@@ -215,10 +353,16 @@ class Room:
         voting_view.message = await self.get_room_channel().send(view=voting_view)
 
     async def obtain_channel(self, category_channel: discord.CategoryChannel):
-        for channel in category_channel.text_channels:
-            if channel_is_free(channel.id):
-                self.room_channel_id = channel.id
+        while self.room_channel_id is None:
+            channel_id = room_channel_pool.acquire(category_channel.id)
+            if channel_id is None:
                 break
+            if bot.get_channel(channel_id) is None:  # Channel is gone, but the pool never heard about it
+                room_channel_pool.remove_channel(channel_id)
+                room_channel_pool.release(channel_id)
+                continue
+            self.room_channel_id = channel_id
+            index_room(self)
         return self.room_channel_id is not None
 
     async def end(self):
@@ -226,6 +370,7 @@ class Room:
             if self.get_room_channel() is not None:
                 await self.change_player_visibility(view=False)
                 await self.get_room_channel().send("The event has ended.")
+            room_permission_manager.forget_members(p.discord_id for p in self.players)
             self.finished = True
 
     async def change_player_visibility(self, view=True):
@@ -233,19 +378,7 @@ class Room:
         if room_channel is None:
             print("Room channel was None in 'change_player_visibility'")
             return
-        category_channel = room_channel.category
-        overwrites = {
-            category_channel.guild.default_role: discord.PermissionOverwrite(view_channel=False),
-            category_channel.guild.me: discord.PermissionOverwrite(view_channel=True)
-        }
-        for player in self.players:
-            discord_member = bot.get_user(player.discord_id)
-            if discord_member is not None:
-                overwrites[discord_member] = discord.PermissionOverwrite(view_channel=view)
-
-        final_text_channel_overwrites = category_channel.overwrites.copy()
-        overwrites.update(final_text_channel_overwrites)
-        await bot.get_channel(self.room_channel_id).edit(overwrites=overwrites)
+        await room_permission_manager.set_visibility(room_channel, [p.discord_id for p in self.players], view)
 
 
 class AdminCog(commands.Cog):
@@ -262,80 +395,69 @@ class AdminCog(commands.Cog):
 
     @queueing_category_group.command(name="set", description="Set a category that text channels will be created under")
     @app_commands.describe(category="Category that text channels will be created under for lineups that gather",
-                           rt_or_ct="Will this category be for RTs or CTs?")
+                           ladder="Which ladder will this category be for?")
+    @app_commands.choices(ladder=LADDER_CHOICES)
     async def set_category(self, interaction: discord.Interaction,
                            category: discord.CategoryChannel,
-                           rt_or_ct: Literal[shared.RT_LADDER, shared.CT_LADDER]):
-        if rt_or_ct == shared.RT_LADDER:
-            global RT_QUEUE_CATEGORY
-            RT_QUEUE_CATEGORY = category.id
-        else:
-            global CT_QUEUE_CATEGORY
-            CT_QUEUE_CATEGORY = category.id
+                           ladder: str):
+        ladders.get(ladder).category_id = category.id
+        rebuild_room_channel_pool()
+        mark_main_data_dirty()
 
         await interaction.response.send_message(
-            f"Text channels will be created under the {category.mention} category for lineups that gather for {rt_or_ct}s.")
+            f"Text channels will be created under the {category.mention} category for lineups that gather for {ladder.upper()}s.")
 
     @queueing_category_group.command(name="view",
                                      description="Display the set categories that text channels will be created under when lineups gather")
     async def view_category(self, interaction: discord.Interaction):
-        rt_category = bot.get_channel(RT_QUEUE_CATEGORY)
-        ct_category = bot.get_channel(CT_QUEUE_CATEGORY)
-
-        rt_category_mention = "Not set" if rt_category is None else rt_category.mention
-        ct_category_mention = "Not set" if ct_category is None else ct_category.mention
-
-        to_send = f"Lineups gathered for RTs will have their rooms created under the following category: {rt_category_mention}\n" + \
-                  f"Lineups gathered for CTs will have their rooms created under the following category: {ct_category_mention}"
-        await interaction.response.send_message(to_send)
+        lines = []
+        for ladder in ladders.get_all():
+            category = None if ladder.category_id is None else bot.get_channel(ladder.category_id)
+            category_mention = "Not set" if category is None else category.mention
+            lines.append(f"Lineups gathered for {ladder.name.upper()}s will have their rooms created under the "
+                         f"following category: {category_mention}")
+        await interaction.response.send_message("\n".join(lines))
 
     @channel_group.command(name="add", description="Specify a channel that players can queue in")
     @app_commands.describe(channel="In what channel is queueing to be allowed?",
-                           rt_or_ct="Will queueing here be for RTs or CTs?")
+                           ladder="Which ladder will queueing here be for?")
+    @app_commands.choices(ladder=LADDER_CHOICES)
     async def add_channel(self, interaction: discord.Interaction,
                           channel: discord.TextChannel,
-                          rt_or_ct: Literal[shared.RT_LADDER, shared.CT_LADDER]):
-        if channel.id in RT_QUEUE_CHANNELS:
+                          ladder: str):
+        current_ladder = ladders.get_by_channel(channel.id)
+        if current_ladder is not None:
             await interaction.response.send_message(
-                f"I am already {channel.mention} is already being monitored for RTs")
-        elif channel.id in CT_QUEUE_CHANNELS:
-            await interaction.response.send_message(f"{channel.mention} is already being monitored for CTs")
+                f"{channel.mention} is already being monitored for {current_ladder.name.upper()}s")
         else:
-            queue_channels = get_queue_channels(rt_or_ct)
-            queue_channels.add(channel.id)
+            ladders.add_queue_channel(ladders.get(ladder), channel.id)
+            mark_main_data_dirty()
             await interaction.response.send_message(
                 f"Players who queue in {channel.mention} will now be added to the "
-                f"{rt_or_ct} queue.")
+                f"{ladder} queue.")
 
     @channel_group.command(name="remove",
                            description="Specify a channel that players are not allowed to queue in anymore")
     @app_commands.describe(channel="In what channel is queueing no longer allowed?")
     async def remove_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
-        if channel.id in RT_QUEUE_CHANNELS:
-            RT_QUEUE_CHANNELS.remove(channel.id)
+        ladder = ladders.remove_queue_channel(channel.id)
+        if ladder is not None:
+            queue_status_board.forget_channel(channel.id)
+            mark_main_data_dirty()
             await interaction.response.send_message(
-                f"I will not allow queueing in {channel.mention} for RTs anymore")
-        elif channel.id in CT_QUEUE_CHANNELS:
-            CT_QUEUE_CHANNELS.remove(channel.id)
-            await interaction.response.send_message(
-                f"I will not allow queueing in {channel.mention} for CTs anymore")
+                f"I will not allow queueing in {channel.mention} for {ladder.name.upper()}s anymore")
         else:
             await interaction.response.send_message(
                 f"I wasn't allowing players to queue in this channel in the first place.")
 
     @channel_group.command(name="view", description="Display all channels that players can queue in")
     async def view_channels(self, interaction: discord.Interaction):
-        rt_channels = []
-        ct_channels = []
-        for channel_id in RT_QUEUE_CHANNELS:
-            rt_channels.append(bot.get_channel(channel_id))
-        for channel_id in CT_QUEUE_CHANNELS:
-            ct_channels.append(bot.get_channel(channel_id))
-
-        to_send = f"Queueing for RTs is allowed in the following channels: " \
-                  f"{', '.join(rtc.mention for rtc in rt_channels)}\n" \
-                  f"Queueing for CTs is allowed in the following channels:{', '.join(ctc.mention for ctc in ct_channels)}"
-        await interaction.response.send_message(to_send)
+        lines = []
+        for ladder in ladders.get_all():
+            channels = (bot.get_channel(channel_id) for channel_id in ladder.queue_channels)
+            lines.append(f"Queueing for {ladder.name.upper()}s is allowed in the following channels: "
+                         f"{', '.join(channel.mention for channel in channels if channel is not None)}")
+        await interaction.response.send_message("\n".join(lines))
 
 
 class TestingCog(commands.Cog):
@@ -361,7 +483,12 @@ class TestingCog(commands.Cog):
     @app_commands.default_permissions()
     async def debug_queue(self, interaction: discord.Interaction):
         await interaction.response.defer()
-        queue_datas = simulation.get_lineup_debug_str(RT_QUEUE, CT_QUEUE)
+        queue_datas = []
+        for ladder in ladders.get_all():
+            queue_datas.append(simulation.get_player_data_str(ladder.queue, ladder_type=ladder.name))
+        for ladder in ladders.get_all():
+            best_lineups = algorithm.get_best_lineup_for_each_group(ladder.queue)
+            queue_datas.append(simulation.get_best_lineups_str(best_lineups, ladder_type=ladder.name))
         await send_queue_data_file(interaction, queue_datas, "queue_data.txt")
 
 
@@ -376,24 +503,73 @@ async def on_ready():
     global finished_on_ready
     print("Logging in...")
     if not finished_on_ready:
-        load_data()
+        loop_lag_monitor.start()
+        timings = {"connect": time.perf_counter() - process_started}
+        phase_started = time.perf_counter()
+        await load_data()
+        rebuild_room_channel_pool()
+        timings["load data"] = time.perf_counter() - phase_started
+
+        phase_started = time.perf_counter()
         await setup(bot)
         if not shared.TESTING:
             bot.tree.remove_command("add")
             bot.tree.remove_command("mllu-text-simulation")
+        timings["setup"] = time.perf_counter() - phase_started
         try:
-            synced = await bot.tree.sync()
-            print(f"Synced {len(synced)} commands: {synced}")
+            phase_started = time.perf_counter()
+            synced = await sync_command_tree(force="--force-sync" in sys.argv[1:])
+            if synced is None:
+                print("Command tree unchanged since the last sync, skipped syncing.")
+            else:
+                print(f"Synced {len(synced)} commands: {synced}")
+            timings["command sync"] = time.perf_counter() - phase_started
             pull_mmr.start()
             run_routines.start()
             restart_rooms()
+            room_deadlines.start()
+            matchmaking_scheduler.start()
+            if shared.METRICS_PORT is not None:
+                await metrics_server.start()
         except Exception as e:
             print(e)
+        timings["total"] = time.perf_counter() - process_started
+        print("Startup timings: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()))
 
     finished_on_ready = True
     print(f"Logged in as {bot.user}")
 
 
+COMMAND_TREE_HASH_FILE = "command_tree_hash"
+
+
+def get_command_tree_hash() -> str:
+    """Stable hash of everything that gets sent to Discord when the global command tree is synced"""
+    payload = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    payload.sort(key=lambda c: (c.get("type", 1), c["name"]))
+    to_hash = json.dumps({"application_id": bot.application_id, "commands": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(to_hash.encode()).hexdigest()
+
+
+def read_command_tree_hash() -> str | None:
+    try:
+        with open(COMMAND_TREE_HASH_FILE, "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+async def sync_command_tree(force=False):
+    """Syncs the command tree with Discord only if it changed since the last sync, unless forced. Returns the
+    synced commands, or None if syncing was skipped."""
+    tree_hash = get_command_tree_hash()
+    if not force and read_command_tree_hash() == tree_hash:
+        return None
+    synced = await bot.tree.sync()
+    persistence.write_atomic(COMMAND_TREE_HASH_FILE, tree_hash.encode())
+    return synced
+
+
 async def add_player_to_queue(interaction: discord.Interaction,
                               player_name: str,
                               queue: game_queue.Queue,
@@ -407,7 +583,7 @@ async def add_player_to_queue(interaction: discord.Interaction,
         msg = f"{player.name} is already in the {ladder_type.upper()} queue."
         if player.can_host != can_host:
             msg = f"{player.name} is {'now' if can_host else 'no longer'} a host."
-            player.can_host = can_host
+            queue.set_host(player, can_host)
         if send_message:
             await interaction.response.send_message(msg)
         return msg
@@ -448,7 +624,7 @@ async def remove_player_from_queue(interaction: discord.Interaction,
                                    player_name: str,
                                    queue: game_queue.Queue,
                                    reason: str = "dropped"):
-    ladder_type = shared.RT_LADDER if queue is RT_QUEUE else shared.CT_LADDER
+    ladder_type = ladders.get_by_queue(queue).name
     partial_player = game_queue.Player.name_to_partial_player(player_name)
     player = queue.remove_from_queue(partial_player)
     if player is None:
@@ -458,19 +634,11 @@ async def remove_player_from_queue(interaction: discord.Interaction,
         f"Removed {player.name} from the {ladder_type.upper()} queue due to: {reason}")
 
 
-async def list_queue(interaction: discord.Interaction, queue: game_queue.Queue, ladder_type: str):
-    if len(queue) == 0:
-        await interaction.response.send_message(f"No players in the {ladder_type.upper()} queue.")
-        return
-    result = f"{ladder_type.upper()} queue:"
-    for index, (group_number, player) in enumerate(queue.get_players_with_group_numbers(), 1):
-        result += f"\n{index}. {player.name} ({player.mmr} MMR)"
-        if group_number is not None:
-            result += f" (group #{group_number})"
-        if player.can_host:
-            result += " - host"
-
-    await interaction.response.send_message(result)
+async def list_queue(interaction: discord.Interaction, ladder_type: str):
+    pages = ladders.get(ladder_type).board.get_pages()
+    await interaction.response.send_message(pages[0])
+    for page in pages[1:]:
+        await interaction.followup.send(page)
 
 
 @bot.tree.command(name="can", description="Join the queue")
@@ -504,33 +672,28 @@ async def remove(interaction: discord.Interaction, player: str):
 @bot.tree.command(name="extend",
                   description=f"Extend channel access for players by {int(Room.ROOM_EXTENSION_TIME.seconds / 60)} minutes")
 async def extend_(interaction: discord.Interaction):
-    for room in rooms:
-        if room.get_room_channel() is not None and room.room_channel_id == interaction.channel_id:
-            if room.expires_soon():
-                if room.extend_goes_past_max_time():
-                    await interaction.response.send_message(f"Cannot extend player access. The maximum time players "
-                                                            f"can view this channel has been reached.", ephemeral=True)
-                else:
-                    room.extend_()
-                    await interaction.response.send_message(f"Channel access for players has been extended by "
-                                                            f"{int(Room.ROOM_EXTENSION_TIME.seconds / 60)} minutes.")
-            else:
-                await interaction.response.send_message(f"Players still have access for {room.minutes_to_expiration()}"
-                                                        f" minutes, so your request has been ignored.", ephemeral=True)
-            break
-    else:
+    room = get_room(interaction.channel_id)
+    if room is None or room.get_room_channel() is None:
         await interaction.response.send_message(f"This is not a room channel.", ephemeral=True)
+    elif room.expires_soon():
+        if room.extend_goes_past_max_time():
+            await interaction.response.send_message(f"Cannot extend player access. The maximum time players "
+                                                    f"can view this channel has been reached.", ephemeral=True)
+        else:
+            room.extend_()
+            await interaction.response.send_message(f"Channel access for players has been extended by "
+                                                    f"{int(Room.ROOM_EXTENSION_TIME.seconds / 60)} minutes.")
+    else:
+        await interaction.response.send_message(f"Players still have access for {room.minutes_to_expiration()}"
+                                                f" minutes, so your request has been ignored.", ephemeral=True)
 
 
 @remove.autocomplete('player')
 async def player_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
-    queue = get_queue(interaction.channel_id)
-    if queue is None:
+    ladder = ladders.get_by_channel(interaction.channel_id)
+    if ladder is None:
         return []
-    return [app_commands.Choice(name=player.name,
-                                value=player.name)
-            for player in queue.get_players() if current.lower() in player.name.lower()
-            ]
+    return [app_commands.Choice(name=name, value=name) for name in ladder.name_index.search(current)]
 
 
 async def group_join(interaction: discord.Interaction,
@@ -557,8 +720,7 @@ async def group_join(interaction: discord.Interaction,
             f"{requester_partial_player.name}'s group already has the maximum number of players allowed in a group.")
         return
 
-    friend = queue.remove_from_queue(friend_partial_player)
-    requester_group.append(friend)
+    friend = queue.merge_into_group(requester_group, friend_partial_player)
     await interaction.followup.send(f"{friend.name} has joined {requester_partial_player.name}'s group.")
 
 
@@ -595,7 +757,7 @@ async def group_add(interaction: discord.Interaction, player: discord.Member):
 
     group_add_view = QueueWithFriend(requester_partial_player,
                                      friend_partial_player,
-                                     shared.RT_LADDER if queue is RT_QUEUE else shared.CT_LADDER)
+                                     ladder_type)
     group_add_view.message = await interaction.response.send_message(
         content=f"{friend_partial_player.name}, would you like to join {requester_partial_player.name}'s group?",
         view=group_add_view)
@@ -626,11 +788,10 @@ async def group_drop(interaction: discord.Interaction):
 
 
 @bot.tree.command(name="list", description="List players in the queue")
-@app_commands.checks.cooldown(rate=1, per=30.0, key=lambda x: x.channel_id)
 async def list_command(interaction: discord.Interaction):
     update_player_activity(interaction.user, interaction.channel.id)
-    queue, ladder_type = get_queue_and_ladder(interaction.channel_id)
-    await list_queue(interaction, queue, ladder_type)
+    _, ladder_type = get_queue_and_ladder(interaction.channel_id)
+    await list_queue(interaction, ladder_type)
 
 
 @bot.tree.error
@@ -658,8 +819,77 @@ async def mllu_text_simulation(interaction: discord.Interaction):
 @bot.tree.command(name="save", description="Save data internally")
 @app_commands.default_permissions()
 async def save(interaction: discord.Interaction):
-    save_data()
-    await interaction.response.send_message("Saved.")
+    await interaction.response.defer()
+    await save_data()
+    await interaction.followup.send(f"Saved.\n{persistence.writer.stats_str()}")
+
+
+@bot.tree.command(name="sync-commands", description="Sync slash commands with Discord, even if they haven't changed")
+@app_commands.default_permissions()
+async def sync_commands(interaction: discord.Interaction):
+    await interaction.response.defer()
+    synced = await sync_command_tree(force=True)
+    await interaction.followup.send(f"Synced {len(synced)} commands.")
+
+
+@bot.tree.command(name="tick-stats", description="Show how long the periodic routines take and which ticks were slow")
+@app_commands.default_permissions()
+async def tick_stats(interaction: discord.Interaction):
+    await interaction.response.send_message(routine_budget.stats_str())
+
+
+@bot.tree.command(name="command-stats",
+                  description="Show how quickly each command and button responds and how long it takes")
+@app_commands.default_permissions()
+async def command_stats_command(interaction: discord.Interaction):
+    pages = shared.split_large_str(command_stats.stats.stats_str())
+    await interaction.response.send_message(pages[0])
+    for page in pages[1:]:
+        await interaction.followup.send(page)
+
+
+@bot.tree.command(name="loop-lag", description="Show how far behind the event loop is running and what blocked it")
+@app_commands.default_permissions()
+async def loop_lag_command(interaction: discord.Interaction):
+    pages = shared.split_large_str(loop_lag_monitor.stats_str())
+    await interaction.response.send_message(pages[0])
+    for page in pages[1:]:
+        await interaction.followup.send(page)
+
+
+@bot.tree.command(name="memory-report",
+                  description="Upload a report of the memory used by the bot's data and where it was allocated")
+@app_commands.default_permissions()
+async def memory_report_command(interaction: discord.Interaction):
+    await interaction.response.defer()
+    await send_queue_data_file(interaction, memory_reporter.report(), "memory_report.txt")
+
+
+@bot.tree.command(name="profile",
+                  description="Profile the next routine ticks and interactions, then upload the profile here")
+@app_commands.default_permissions()
+async def profile_command(interaction: discord.Interaction, ticks: app_commands.Range[int, 0, 60] = 3,
+                          interactions: app_commands.Range[int, 0, 500] = 0):
+    channel = interaction.channel
+
+    async def upload_profile(summary: str, report_file: str, stats_file: str | None):
+        files = [discord.File(report_file)] + ([discord.File(stats_file)] if stats_file is not None else [])
+        await channel.send(summary, files=files)
+
+    if ticks + interactions == 0:
+        await interaction.response.send_message("Give at least one routine tick or interaction to profile.")
+    elif not profiler.profiler.start(ticks, interactions, upload_profile):
+        await interaction.response.send_message("A profile is already being captured, wait for it to be uploaded.")
+    else:
+        await interaction.response.send_message(
+            f"Profiling the next {ticks} routine tick(s) and {interactions} interaction(s). The profile will be "
+            f"uploaded here when they are done, or after {profiler.Profiler.MAX_CAPTURE_SECONDS // 60} minutes.")
+
+
+@bot.tree.command(name="outbound-stats", description="Show the queue depth and latency of outgoing messages")
+@app_commands.default_permissions()
+async def outbound_stats(interaction: discord.Interaction):
+    await interaction.response.send_message(outbound_dispatcher.stats_str() + "\n" + queue_status_board.stats_str())
 
 
 class MLLUTextModal(ui.Modal, title="MogiBot's #mogilist-lu message in Lounge"):
@@ -685,7 +915,8 @@ async def run_drop_warn(ladder_type: str):
     warn_time = datetime.timedelta(minutes=shared.WARN_DROP_TIME)
     drop_time = datetime.timedelta(minutes=shared.AUTO_DROP_TIME)
     queue = get_queue(ladder_type)
-    channel_ids = RT_QUEUE_CHANNELS if ladder_type == shared.RT_LADDER else CT_QUEUE_CHANNELS
+    channel_ids = get_queue_channels(ladder_type)
+    flush_player_activity(ladder_type)
 
     # Drop players who have been warned, are no longer active, and are beyond the drop time
     to_drop: List[game_queue.Player] = []
@@ -699,9 +930,7 @@ async def run_drop_warn(ladder_type: str):
         for player in to_drop:
             queue.remove_from_queue(player)
 
-        channels_to_notify: List[discord.TextChannel] = [bot.get_channel(channel_id) for channel_id in channel_ids]
-        for channel in channels_to_notify:
-            await channel.send(builder_str)
+        outbound_dispatcher.send_to_many(channel_ids, builder_str)
 
     # Warn players about dropping because they have been inactive
     to_warn: List[game_queue.Player] = []
@@ -714,34 +943,44 @@ async def run_drop_warn(ladder_type: str):
         player.drop_warned = True
         players_to_warn_by_channel[player.queue_channel_id].append(player)
     for channel_id, players in players_to_warn_by_channel.items():
-        channel = bot.get_channel(channel_id)
         builder_str = f"{', '.join(mention(p) for p in players)} you will be dropped from the queue in " \
                       f"{shared.AUTO_DROP_TIME - shared.WARN_DROP_TIME} minutes due to inactivity. " \
                       f"Please type something in the chat to remain in the queue."
-        await channel.send(builder_str)
+        outbound_dispatcher.send(channel_id, builder_str)
 
 
 async def drop_warn():
-    await run_drop_warn(shared.RT_LADDER)
-    await run_drop_warn(shared.CT_LADDER)
-
-
-def save_data():
-    RT_QUEUE.prepare_save()
-    CT_QUEUE.prepare_save()
-    to_dump = {"RT_QUEUE_CHANNELS": RT_QUEUE_CHANNELS,
-               "CT_QUEUE_CHANNELS": CT_QUEUE_CHANNELS,
-               "RT_QUEUE": RT_QUEUE,
-               "CT_QUEUE": CT_QUEUE,
-               "RT_QUEUE_CATEGORY": RT_QUEUE_CATEGORY,
-               "CT_QUEUE_CATEGORY": CT_QUEUE_CATEGORY,
-               "rooms": rooms}
-    with open("main_pkl", "wb") as f:
-        pickle.dump(to_dump, f)
-    rating.save_data()
-    fc_commands.save_data()
-    RT_QUEUE.reload(bot.get_guild(shared.LOUNGE_GUILD_ID))
-    CT_QUEUE.reload(bot.get_guild(shared.LOUNGE_GUILD_ID))
+    await asyncio.gather(*(run_drop_warn(ladder.name) for ladder in ladders.get_all()))
+
+
+MAIN_DATA_FILE = "main_pkl"
+# Saves before records were introduced pickled the live queue and room objects and have no "SAVE_FORMAT". Saves in
+# format 2 had the RT and CT ladders in their own keys.
+SAVE_FORMAT = 3
+
+
+def get_save_snapshot() -> dict:
+    """Copies everything that needs saving into plain records. The live queues, rooms and players are only read."""
+    return {"SAVE_FORMAT": SAVE_FORMAT,
+            "LADDERS": {ladder.name: ladder.to_record() for ladder in ladders.get_all()},
+            "rooms": [room.to_record() for room in rooms],
+            "QUEUE_STATUS_MESSAGES": dict(queue_status_board.message_ids)}
+
+
+persistence.writer.register(MAIN_DATA_FILE, get_save_snapshot)
+
+
+def mark_main_data_dirty(*_):
+    persistence.writer.mark_dirty(MAIN_DATA_FILE)
+
+
+for _ladder in ladders.get_all():
+    _ladder.queue.subscribe(mark_main_data_dirty)
+
+
+async def save_data():
+    """Writes all data to disk now"""
+    await persistence.writer.flush_all()
 
 
 def restart_rooms():
@@ -760,34 +999,82 @@ def add_rooms_restart():
             to_restart.append(room)
 
 
-def load_data():
+def read_main_data():
     try:
-        with open("main_pkl", "rb") as f:
-            to_load = pickle.load(f)
-            RT_QUEUE_CHANNELS.clear()
-            RT_QUEUE_CHANNELS.update(to_load["RT_QUEUE_CHANNELS"])
-            CT_QUEUE_CHANNELS.clear()
-            CT_QUEUE_CHANNELS.update(to_load["CT_QUEUE_CHANNELS"])
-            RT_QUEUE.clear()
-            RT_QUEUE.extend(to_load["RT_QUEUE"])
-            RT_QUEUE.reload(bot.get_guild(shared.LOUNGE_GUILD_ID))
-            CT_QUEUE.clear()
-            CT_QUEUE.extend(to_load["CT_QUEUE"])
-            CT_QUEUE.reload(bot.get_guild(shared.LOUNGE_GUILD_ID))
-            global RT_QUEUE_CATEGORY
-            RT_QUEUE_CATEGORY = to_load["RT_QUEUE_CATEGORY"]
-            global CT_QUEUE_CATEGORY
-            CT_QUEUE_CATEGORY = to_load["CT_QUEUE_CATEGORY"]
-            rooms.clear()
-            rooms.extend(to_load["rooms"])
-            add_rooms_restart()
+        with open(MAIN_DATA_FILE, "rb") as f:
+            return pickle.load(f)
     except Exception as e:
         logging.critical("Failed to load main pickle:")
         logging.critical(e)
         raise e
-    rating.load_data()
-    fc_commands.load_data()
-    print("All data loaded.")
+
+
+def get_saved_ladders(to_load: dict) -> Dict[str, dict]:
+    """Returns the saved state of each ladder as a ladder record, except that "queue" holds the queue's groups"""
+    save_format = to_load.get("SAVE_FORMAT")
+    if save_format == SAVE_FORMAT:
+        return {name: {**record, "queue": game_queue.Queue.groups_from_records(record["queue"])}
+                for name, record in to_load["LADDERS"].items()}
+    saved_ladders = {}
+    for ladder_type, prefix in ((shared.RT_LADDER, "RT"), (shared.CT_LADDER, "CT")):
+        saved_queue = to_load[f"{prefix}_QUEUE"]
+        saved_ladders[ladder_type] = {
+            "queue_channels": to_load[f"{prefix}_QUEUE_CHANNELS"],
+            "queue": saved_queue if save_format is None else game_queue.Queue.groups_from_records(saved_queue),
+            "category_id": to_load[f"{prefix}_QUEUE_CATEGORY"],
+            "last_room_formed": to_load.get("LAST_ROOM_FORMED_TIMES", {}).get(ladder_type)}
+    return saved_ladders
+
+
+def apply_main_data(to_load: dict):
+    from_records = to_load.get("SAVE_FORMAT") is not None
+    guild = bot.get_guild(shared.LOUNGE_GUILD_ID)
+    for name, saved_ladder in get_saved_ladders(to_load).items():
+        ladder = ladders.get(name)
+        if ladder is None:
+            logging.warning(f"Dropping the saved data of the {name} ladder, which doesn't exist anymore")
+            continue
+        ladder.load(saved_ladder["queue_channels"], saved_ladder["queue"], saved_ladder["category_id"],
+                    saved_ladder["last_room_formed"])
+        ladder.queue.reload(guild)
+        # Names were indexed from the save, before the players had their members back
+        ladder.name_index.refresh_all()
+    rooms.clear()
+    if from_records:
+        rooms.extend(Room.from_record(record, guild) for record in to_load["rooms"])
+    else:
+        rooms.extend(to_load["rooms"])
+    reindex_rooms()
+    for room in rooms:
+        schedule_room_deadlines(room)
+    queue_status_board.load(to_load.get("QUEUE_STATUS_MESSAGES", {}))
+    add_rooms_restart()
+    # Only now does the state in memory hold the save, writing it before would overwrite the save with empty queues
+    persistence.writer.mark_loaded(MAIN_DATA_FILE)
+
+
+async def load_data():
+    """Reads every save file at once in worker threads, then applies them on the event loop"""
+    timings = {}
+    phase_started = time.perf_counter()
+    main_data, rating_data, fc_data = await asyncio.gather(asyncio.to_thread(read_main_data),
+                                                           asyncio.to_thread(rating.read_data),
+                                                           asyncio.to_thread(fc_commands.read_data))
+    timings["read"] = time.perf_counter() - phase_started
+
+    # Queued players are dropped when their member can't be found, so the member cache has to be complete first
+    phase_started = time.perf_counter()
+    guild = bot.get_guild(shared.LOUNGE_GUILD_ID)
+    if guild is not None and not guild.chunked:
+        await guild.chunk()
+    timings["member cache"] = time.perf_counter() - phase_started
+
+    phase_started = time.perf_counter()
+    apply_main_data(main_data)
+    rating.apply_data(rating_data)
+    fc_commands.apply_data(fc_data)
+    timings["apply"] = time.perf_counter() - phase_started
+    print("All data loaded: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()))
 
 
 def update_player_activity(member: discord.Member | str, channel_id: int):
@@ -795,35 +1082,94 @@ def update_player_activity(member: discord.Member | str, channel_id: int):
     if queue is None:
         return
     if isinstance(member, str):
-        partial_player = game_queue.Player.name_to_partial_player(member)
+        actual_player = queue.get_player(game_queue.Player.name_to_partial_player(member))
+        if actual_player is not None:
+            actual_player.update_activity()
     else:
-        partial_player = game_queue.Player.discord_member_to_partial_player(member)
-    actual_player = queue.get_player(partial_player)
-    if actual_player is not None:
-        actual_player.update_activity()
+        for actual_player in queue.get_players_by_discord_id(member.id):
+            actual_player.update_activity()
+
+
+def flush_player_activity(ladder_type: str):
+    queue = get_queue(ladder_type)
+    activity = ladders.get(ladder_type).pending_activity
+    for discord_id, last_active in activity.items():
+        for player in queue.get_players_by_discord_id(discord_id):
+            if player.last_active is None or last_active > player.last_active:
+                player.update_activity(last_active)
+    activity.clear()
 
 
 @bot.event
 async def on_message(message: discord.Message):
-    update_player_activity(message.author, message.channel.id)
+    # Runs for every message in the server, so anyone who isn't queued should cost no more than a couple lookups
+    ladder = ladders.get_by_channel(message.channel.id)
+    if ladder is None or not ladder.queue.has_discord_id(message.author.id):
+        return
+    ladder.pending_activity[message.author.id] = datetime.datetime.now()
+
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    room_permission_manager.forget_members([member.id])
+
+
+def refresh_player_names(discord_id: int):
+    for ladder in ladders.get_all():
+        for player in ladder.queue.get_players_by_discord_id(discord_id):
+            ladder.name_index.refresh(player)
+
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.display_name != after.display_name:
+        refresh_player_names(after.id)
+
+
+@bot.event
+async def on_user_update(before: discord.User, after: discord.User):
+    # Changing the global display name changes the display name in every server without a nickname
+    if before.display_name != after.display_name:
+        refresh_player_names(after.id)
+
+
+@bot.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    if isinstance(channel, discord.TextChannel) and channel.category_id is not None:
+        room_channel_pool.add_channel(channel.category_id, channel.id)
+
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    room_channel_pool.remove_channel(channel.id)
+
+
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    if isinstance(after, discord.TextChannel) and before.category_id != after.category_id:
+        room_channel_pool.remove_channel(after.id)
+        if after.category_id is not None:
+            room_channel_pool.add_channel(after.category_id, after.id)
 
 
 def update_queued_player_ratings(ladder_type: str):
-    queue = get_queue(ladder_type)
-    for player in queue.get_players():
+    def get_rating(player: game_queue.Player):
         player_rating = rating.get_player_rating(player.get_queue_key(), ladder_type)
         if player_rating is not None:
-            player.mmr = player_rating[2]
-            player.lr = player_rating[3]
-            # print(f"Updated {player.name} MMR to {player.mmr} and LR to {player.lr}")
+            return player_rating[2], player_rating[3]
+
+    queue = get_queue(ladder_type)
+    queue.update_ratings(get_rating)
+
+
+async def pull_ladder_mmr(ladder_type: str):
+    await rating.pull_mmr_data(ladder_type)
+    update_queued_player_ratings(ladder_type)
 
 
 @tasks.loop(minutes=30, reconnect=True)
 async def pull_mmr():
-    await rating.pull_mmr_data(shared.RT_LADDER)
-    update_queued_player_ratings(shared.RT_LADDER)
-    await rating.pull_mmr_data(shared.CT_LADDER)
-    update_queued_player_ratings(shared.CT_LADDER)
+    await asyncio.gather(*(pull_ladder_mmr(ladder.name) for ladder in ladders.get_all()))
     logging.info(f"Pulled mmr")
 
 
@@ -834,99 +1180,174 @@ def remove_all_players(players: List[game_queue.Player], ladder_type: str):
 
 
 async def send_message_to_all_queue_channels(message: str, ladder_type: str):
-    channel_ids = RT_QUEUE_CHANNELS if ladder_type == shared.RT_LADDER else CT_QUEUE_CHANNELS
-    channels: List[discord.TextChannel] = [bot.get_channel(channel_id) for channel_id in channel_ids]
-    for channel in channels:
-        await channel.send(message)
+    """Queues the message for every queue channel of the ladder. Does not wait for the messages to be delivered."""
+    return outbound_dispatcher.send_to_many(get_queue_channels(ladder_type), message)
+
+
+def get_queue_status_str(ladder_type: str, best_score: float | None) -> str:
+    ladder = ladders.get(ladder_type)
+    lines = [f"**{ladder_type.upper()} queue status**",
+             f"Players queued: {ladder.queue.count_players_queued()}"]
+    if best_score is None:
+        lines.append(f"Best lineup score: not enough players for a room ({algorithm.LINEUP_SIZE} are needed)")
+    else:
+        lines.append(f"Best lineup score: {best_score:.2f} (a room forms at {ladder.score_threshold})")
+    last_room_formed = ladder.last_room_formed
+    if last_room_formed is None:
+        lines.append("Last room formed: none yet")
+    else:
+        # Discord renders this relative to the reader's clock, so the message doesn't have to be edited as time passes
+        lines.append(f"Last room formed: <t:{int(last_room_formed.timestamp())}:R>")
+    return "\n".join(lines)
 
 
 async def form_lineups(ladder_type: str):
-    channel_ids = RT_QUEUE_CHANNELS if ladder_type == shared.RT_LADDER else CT_QUEUE_CHANNELS
-    channels: List[discord.TextChannel] = [bot.get_channel(channel_id) for channel_id in channel_ids]
-    to_edit = []
-    for channel in channels:
-        to_edit.append((await channel.send("Looking for rooms that can be created...")))
+    """Forms rooms for as long as the best lineup in the queue meets the score threshold, then updates the status
+    messages of the ladder's queue channels. Only call this through matchmaking_scheduler so that two searches never
+    run on the same queue at once."""
+    ladder = ladders.get(ladder_type)
+    queue = ladder.queue
+    # Lineup scores grow with queue time, so an unchanged queue still needs to be searched when it is large enough
+    # to form a room. Otherwise there is nothing new to search or to show.
+    queue_changed = queue.version != ladder.last_formation_version
+    if not queue_changed and queue.count_players_queued() < algorithm.LINEUP_SIZE:
+        return
 
-    queue = get_queue(ladder_type)
-    formed_lineup = False
+    search_started = time.perf_counter()
+    best_score = None
+    new_rooms = []
     while True:
         best_lineups = algorithm.get_best_lineup_for_each_group(queue)
         sorted_by_score = sorted(best_lineups, key=algorithm.compute_lineup_score, reverse=True)
+        best_score = None
         if len(sorted_by_score) > 0:
             best_lineup = sorted_by_score[0]
-            if algorithm.compute_lineup_score(best_lineup) >= algorithm.SCORE_THRESHOLD:
+            best_score = algorithm.compute_lineup_score(best_lineup)
+            if best_score >= ladder.score_threshold:
                 # pop room for the players
-                formed_lineup = True
-                event_str = "an" if ladder_type == shared.RT_LADDER else "a"
-                text_str = f"A room has formed. Starting {event_str} {ladder_type.upper()} event for " \
+                text_str = f"A room has formed. Starting {ladder.article} {ladder_type.upper()} event for " \
                            f"`{', '.join(p.name for p in best_lineup)}`..."
                 my_str = simulation.get_best_lineups_str([best_lineup], ladder_type, header=False)
 
-                # remove all players from both queues
-                remove_all_players(best_lineup, shared.RT_LADDER)
-                remove_all_players(best_lineup, shared.CT_LADDER)
+                # remove all players from every queue
+                for other_ladder in ladders.get_all():
+                    remove_all_players(best_lineup, other_ladder.name)
 
                 await send_message_to_all_queue_channels(text_str + "\n" + my_str, ladder_type)
 
                 cur_room = Room(best_lineup, ladder_type)
                 rooms.append(cur_room)
-
-                await cur_room.begin_event()
+                schedule_room_deadlines(cur_room)
+                ladder.last_room_formed = datetime.datetime.now()
+                ROOMS_FORMED.inc(ladder=ladder_type)
+                mark_main_data_dirty()
+                new_rooms.append(cur_room)
 
             else:
                 break
         else:
             break
 
-    if formed_lineup is False:
-        for msg in to_edit:
-            await msg.edit(content="No rooms can be formed.")
+    # Channels are handed out synchronously, so every room formed this time can start at the same time
+    await asyncio.gather(*(room.begin_event() for room in new_rooms))
 
+    MATCHMAKING_SECONDS.observe(time.perf_counter() - search_started, ladder=ladder_type)
+    ladder.best_score = best_score
+    ladder.status_stale = True
+    # Status messages are not critical, when the routines are struggling they wait for a tick with time to spare
+    if not routine_budget.should_shed():
+        publish_queue_status(ladder)
+    ladder.last_formation_version = queue.version
 
-async def delete_expired_rooms():
-    # This function is intentionally written this way to avoid race conditions with other asynchronous code
-    to_end = []
-    index_removal = []
-    for room_index, room in enumerate(rooms):
-        if room.is_expired():
-            to_end.append(room)
-            index_removal.append(room_index)
 
-    for index in index_removal[::-1]:
-        rooms.pop(index)
+def publish_queue_status(ladder: ladders.Ladder):
+    queue_status_board.update(ladder.queue_channels, get_queue_status_str(ladder.name, ladder.best_score))
+    ladder.status_stale = False
 
-    for r in to_end:
-        await r.end()
 
+async def publish_stale_queue_statuses():
+    for ladder in ladders.get_all():
+        if ladder.status_stale:
+            publish_queue_status(ladder)
 
-async def warn_almost_expired_rooms():
-    for room in rooms:
-        if room.should_warn_expiration():
-            await room.warn_expiration()
+
+matchmaking_scheduler = matchmaking.MatchmakingScheduler(form_lineups)
+
+
+def trigger_matchmaking(queue: game_queue.Queue, event: str, players: List[game_queue.Player]):
+    if event != game_queue.Queue.HOST_UPDATED:
+        matchmaking_scheduler.trigger(ladders.get_by_queue(queue).name)
+
+
+for _ladder in ladders.get_all():
+    _ladder.queue.subscribe(trigger_matchmaking)
+
+
+room_deadlines = deadlines.DeadlineScheduler()
+
+
+def schedule_room_deadlines(room: Room):
+    """(Re)schedules the expiration warning and the expiration of the room. Call again whenever its expiration
+    time changes."""
+    events = [(room.expiration_time, lambda: expire_room(room))]
+    if not room.expiration_warning_sent:
+        events.append((room.expiration_time - Room.ROOM_WARN_TIME, lambda: warn_room_expiration(room)))
+    room_deadlines.schedule(room, events)
+
+
+async def warn_room_expiration(room: Room):
+    if room.should_warn_expiration():
+        await room.warn_expiration()
+
+
+async def expire_room(room: Room):
+    room_deadlines.cancel(room)
+    if room not in rooms:
+        return
+    # Remove the room before awaiting anything so other asynchronous code never sees an expired room
+    rooms.remove(room)
+    unindex_room(room)
+    room_channel_pool.release(room.room_channel_id)
+    mark_main_data_dirty()
+    await room.end()
 
 
 @tasks.loop(minutes=1, reconnect=True)
 async def run_routines():
+    await profiler.profiler.run(profiler.ROUTINE_TICK, run_routines_tick)
+
+
+async def run_routines_tick():
+    tick = routine_budget.start_tick()
     try:
-        await drop_warn()
-        await delete_expired_rooms()
-        await form_lineups(ladder_type=shared.RT_LADDER)
-        await form_lineups(ladder_type=shared.CT_LADDER)
-        await warn_almost_expired_rooms()
+        await tick.run("drop warn", drop_warn)
+        # Queue changes trigger matchmaking on their own, this is the fallback for lineups whose score went past
+        # the threshold only because their players have been waiting longer. Ladders don't share state, so they are
+        # searched side by side.
+        await asyncio.gather(*(tick.run(f"{ladder.name} matchmaking",
+                                        lambda ladder_type=ladder.name: matchmaking_scheduler.run_now(ladder_type))
+                               for ladder in ladders.get_all()))
+        await tick.run("status messages", publish_stale_queue_statuses, critical=False)
     except Exception as e:
         logging.critical("Exception occurred in run_routine loop:")
         logging.exception(e)
         try:
-            all_queue_channels = RT_QUEUE_CHANNELS | CT_QUEUE_CHANNELS
-            for channel_id in all_queue_channels:
-                await bot.get_channel(channel_id).send(
-                    f"Tell Bad Wolf to check the logs. The following error occurred: {e}")
+            all_queue_channels = set().union(*(ladder.queue_channels for ladder in ladders.get_all()))
+            outbound_dispatcher.send_to_many(all_queue_channels,
+                                             f"Tell Bad Wolf to check the logs. The following error occurred: {e}")
         except Exception as f:
             logging.critical("Exception occurred in run_routine loop queue channel sending:")
             logging.exception(f)
+    finally:
+        routine_budget.finish_tick(tick)
+        ROUTINE_TICK_SECONDS.observe(tick.elapsed())
+        for stage, seconds in tick.stage_times.items():
+            ROUTINE_STAGE_SECONDS.observe(seconds, stage=stage)
+        for stage in tick.deferred:
+            ROUTINE_STAGES_DEFERRED.inc(stage=stage)
 
 
-class QueueWithFriend(discord.ui.View):
+class QueueWithFriend(command_stats.TimedView):
     RESPONSE_TIMEOUT = datetime.timedelta(minutes=5)
 
     @staticmethod
@@ -977,12 +1398,15 @@ class QueueWithFriend(discord.ui.View):
             await group_join(interaction, self.requester_partial, self.friend_partial, self.ladder_type)
 
 
-class Voting(discord.ui.View):
+class Voting(command_stats.TimedView):
     if shared.TESTING:
         VOTE_TIME = datetime.timedelta(seconds=30)
     else:
         VOTE_TIME = datetime.timedelta(minutes=2)
 
+    # Vote counts shown on the buttons are refreshed at most once per this many seconds
+    LABEL_UPDATE_INTERVAL = 1.5
+
     @staticmethod
     def get_voting_seconds():
         return Voting.VOTE_TIME.seconds
@@ -990,10 +1414,14 @@ class Voting(discord.ui.View):
     def __init__(self, players: List[game_queue.Player], on_finish_callback, **kwargs):
         self.votes = {"FFA": set(), "2v2": set(), "3v3": set(), "4v4": set(), "6v6": set()}
         self.players: List[game_queue.Player] = players
+        self.valid_voter_keys = {player.get_queue_key() for player in players}
+        self.voter_choices: Dict[Any, str] = {}
         self.voting = True
+        self.label_update_task: asyncio.Task | None = None
         self.__on_finish_callback = on_finish_callback
         asyncio.create_task(self.vote_timeout())
         super().__init__(**kwargs)
+        self.vote_buttons = {child.label.split(" - ")[0]: child for child in self.children}
 
     async def vote_timeout(self):
         await asyncio.sleep(Voting.get_voting_seconds())
@@ -1018,48 +1446,63 @@ class Voting(discord.ui.View):
         return random.choice(winning_votes)
 
     def is_valid_voter(self, player_key: Any) -> bool:
-        return any(player.get_queue_key() == player_key for player in self.players)
+        return player_key in self.valid_voter_keys
 
     def place_vote(self, player_key: Any, vote: str):
-        for voters in self.votes.values():
-            if player_key in voters:
-                voters.remove(player_key)
+        """Moves the player's vote to the given option and returns the option it was on before, if any"""
+        previous_vote = self.voter_choices.get(player_key)
+        if previous_vote is not None:
+            self.votes[previous_vote].discard(player_key)
+        self.voter_choices[player_key] = vote
         self.votes[vote].add(player_key)
+        return previous_vote
 
-    def update_labels(self):
-        for vote_option, votes in self.votes.items():
-            for child in self.children:
-                if child.label.startswith(vote_option):
-                    child.label = f"{vote_option} - {len(votes)}"
-                    break
+    def update_labels(self, *vote_options: str):
+        for vote_option in vote_options or self.votes:
+            self.vote_buttons[vote_option].label = f"{vote_option} - {len(self.votes[vote_option])}"
 
-    def has_winner(self):
-        for votes in self.votes.values():
-            if len(votes) >= int((algorithm.LINEUP_SIZE + 1) / 2):  # if the majority voted for an option
+    def has_winner(self, vote_option: str = None):
+        # Only the option that was just voted for can have become the majority
+        vote_options = self.votes if vote_option is None else (vote_option,)
+        for option in vote_options:
+            if len(self.votes[option]) >= int((algorithm.LINEUP_SIZE + 1) / 2):  # if the majority voted for an option
                 return True
         return False
 
+    def schedule_label_update(self, message: discord.Message):
+        """Edits the message with the current vote counts soon. Votes that come in before then share the edit."""
+        if self.label_update_task is None or self.label_update_task.done():
+            self.label_update_task = asyncio.create_task(self.update_labels_later(message))
+
+    async def update_labels_later(self, message: discord.Message):
+        await asyncio.sleep(Voting.LABEL_UPDATE_INTERVAL)
+        if self.voting:
+            await message.edit(view=self)
+
     async def vote_button(self, interaction: discord.Interaction, button: discord.ui.Button, original_label: str):
+        await interaction.response.defer()
         if not self.voting:
             return
         voter_queue_key = game_queue.Player.discord_member_to_partial_player(interaction.user).get_queue_key()
-
         if not self.is_valid_voter(voter_queue_key):
-            await interaction.response.defer()
             return
 
-        self.place_vote(voter_queue_key, original_label)
-        self.update_labels()
-        if self.has_winner():
-            self.voting = False
-            for child in self.children:
-                child.disabled = True
-        await interaction.message.edit(view=self)
-        await interaction.response.defer()
+        previous_vote = self.place_vote(voter_queue_key, original_label)
+        if previous_vote == original_label:
+            return
+        self.update_labels(*(option for option in (previous_vote, original_label) if option is not None))
+        if not self.has_winner(original_label):
+            self.schedule_label_update(interaction.message)
+            return
 
-        if not self.voting:
-            self.stop()
-            await self.__on_finish_callback(self.get_winner(), self.votes)
+        self.voting = False
+        self.stop()
+        if self.label_update_task is not None:
+            self.label_update_task.cancel()
+        for child in self.children:
+            child.disabled = True
+        await interaction.message.edit(view=self)
+        await self.__on_finish_callback(self.get_winner(), self.votes)
 
     @discord.ui.button(label='FFA - 0', style=discord.ButtonStyle.red)
     async def ffa(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -1095,11 +1538,21 @@ def mention(user: int | game_queue.Player):
     return f"<@{user_id}>" if discord_member is None else discord_member.mention
 
 
+def run_self_tests() -> bool:
+    import unittest
+    import test_rooms
+    import test_save_data
+    test_rooms.set_room(Room)
+    test_save_data.set_main(sys.modules[__name__])
+    suite = unittest.TestLoader().loadTestsFromModule(test_rooms)
+    suite.addTests(unittest.TestLoader().loadTestsFromModule(test_save_data))
+    # run all tests with verbosity
+    return unittest.TextTestRunner(verbosity=2).run(suite).wasSuccessful()
+
+
 if __name__ == "__main__":
-    if shared.RUN_UNIT_TESTS:
-        test_rooms.set_room(Room)
-        suite = unittest.TestLoader().loadTestsFromModule(test_rooms)
-        # run all tests with verbosity
-        unittest.TextTestRunner(verbosity=2).run(suite)
+    # Self tests only run when asked for with "python main.py --self-test", and the bot is not started afterwards
+    if "--self-test" in sys.argv[1:]:
+        sys.exit(0 if run_self_tests() else 1)
 
     bot.run(TOKEN, log_level=logging.INFO)
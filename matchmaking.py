@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import Callable, Awaitable, Dict
+
+
+class MatchmakingScheduler:
+    """Runs matchmaking for each ladder as its own task shortly after its queue changes.
+
+    Changes that arrive within DEBOUNCE_SECONDS of each other are coalesced into a single run, but a busy queue is
+    never delayed by more than MAX_DELAY_SECONDS. Runs for the same ladder never overlap: every run, including the
+    periodic fallback, goes through run_now, which holds the ladder's lock.
+    """
+    DEBOUNCE_SECONDS = 2
+    MAX_DELAY_SECONDS = 10
+
+    def __init__(self, run_matchmaking: Callable[[str], Awaitable]):
+        # run_matchmaking(ladder_type)
+        self.run_matchmaking = run_matchmaking
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.pending: Dict[str, asyncio.Task] = {}
+        self.last_requested: Dict[str, float] = {}
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def get_lock(self, ladder_type: str) -> asyncio.Lock:
+        if ladder_type not in self.locks:
+            self.locks[ladder_type] = asyncio.Lock()
+        return self.locks[ladder_type]
+
+    def trigger(self, ladder_type: str):
+        """Requests a matchmaking run for the ladder soon. Safe to call from synchronous code on the event loop."""
+        if not self.started:
+            return
+        loop = asyncio.get_running_loop()
+        self.last_requested[ladder_type] = loop.time()
+        task = self.pending.get(ladder_type)
+        if task is None or task.done():
+            self.pending[ladder_type] = asyncio.create_task(self._debounced_run(ladder_type))
+
+    async def _debounced_run(self, ladder_type: str):
+        loop = asyncio.get_running_loop()
+        first_requested = self.last_requested[ladder_type]
+        while True:
+            run_at = min(self.last_requested[ladder_type] + MatchmakingScheduler.DEBOUNCE_SECONDS,
+                         first_requested + MatchmakingScheduler.MAX_DELAY_SECONDS)
+            if loop.time() < run_at:
+                await asyncio.sleep(run_at - loop.time())
+                continue
+            run_started = loop.time()
+            try:
+                await self.run_now(ladder_type)
+            except Exception as e:
+                logging.critical(f"Exception occurred while matchmaking for {ladder_type}:")
+                logging.exception(e)
+            # Anything that changed while the run was going on needs another run
+            if self.last_requested[ladder_type] <= run_started:
+                break
+            first_requested = self.last_requested[ladder_type]
+
+    async def run_now(self, ladder_type: str):
+        async with self.get_lock(ladder_type):
+            await self.run_matchmaking(ladder_type)
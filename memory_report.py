@@ -0,0 +1,127 @@
+import datetime
+import linecache
+import sys
+import tracemalloc
+import types
+from collections import deque
+from typing import Any, Callable, Dict, List, Tuple
+
+TRACE_FRAMES = 10
+TOP_SITES = 25
+_NOT_FOLLOWED = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                 types.CodeType, types.FrameType)
+
+
+def deep_size(root: Any) -> Tuple[int, int]:
+    """Returns the bytes taken by root and everything it references, and how many discord.py objects it references.
+    discord.py objects are not followed, they belong to discord.py's cache and would pull in the whole guild. Neither
+    are classes, modules and functions."""
+    seen = set()
+    to_visit = [root]
+    size = 0
+    discord_objects = 0
+    while len(to_visit) > 0:
+        obj = to_visit.pop()
+        if id(obj) in seen or isinstance(obj, _NOT_FOLLOWED):
+            continue
+        seen.add(id(obj))
+        if type(obj).__module__.startswith("discord"):
+            discord_objects += 1
+            continue
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            to_visit.extend(obj.keys())
+            to_visit.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            to_visit.extend(obj)
+        attributes = getattr(obj, "__dict__", None)
+        if attributes is not None:
+            to_visit.append(attributes)
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if hasattr(obj, slot):
+                    to_visit.append(getattr(obj, slot))
+    return size, discord_objects
+
+
+def _format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class MemoryReporter:
+    """Reports how much memory the bot's long-lived structures take and where memory was allocated, compared with the
+    previous report.
+
+    Allocation sites come from tracemalloc, which only sees allocations made after it was started. The first report
+    starts it if it isn't running yet (or call start_tracing at startup), so allocation sites show up from the second
+    report on. Structure sizes are measured by walking the structures, which blocks the event loop for a moment."""
+
+    def __init__(self):
+        self.structures: Dict[str, Callable[[], Any]] = {}
+        self.previous_snapshot: tracemalloc.Snapshot | None = None
+        self.previous_sizes: Dict[str, int] = {}
+        self.previous_report_time: datetime.datetime | None = None
+
+    def register(self, name: str, get_structure: Callable[[], Any]):
+        self.structures[name] = get_structure
+
+    @staticmethod
+    def start_tracing():
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+
+    def structures_report(self) -> List[str]:
+        lines = ["Long-lived structures (size, change since the last report, discord.py objects referenced):"]
+        sizes = {}
+        for name, get_structure in self.structures.items():
+            size, discord_objects = deep_size(get_structure())
+            sizes[name] = size
+            change = ""
+            if name in self.previous_sizes:
+                change = f", {'+' if size >= self.previous_sizes[name] else '-'}" \
+                         f"{_format_size(abs(size - self.previous_sizes[name]))}"
+            lines.append(f"  {name}: {_format_size(size)}{change}, {discord_objects} discord.py objects")
+        self.previous_sizes = sizes
+        return lines
+
+    @staticmethod
+    def _site_str(traceback: tracemalloc.Traceback) -> str:
+        frame = traceback[0]
+        line = linecache.getline(frame.filename, frame.lineno).strip()
+        return f"{frame.filename}:{frame.lineno}" + (f" ({line})" if line else "")
+
+    def allocations_report(self) -> List[str]:
+        if not tracemalloc.is_tracing():
+            self.start_tracing()
+            return ["tracemalloc was not running and has been started now, allocation sites will be in the next "
+                    "report."]
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>")))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced memory: {_format_size(current)} now, {_format_size(peak)} at peak", "",
+                 f"Top {TOP_SITES} allocation sites:"]
+        for stat in snapshot.statistics("lineno")[:TOP_SITES]:
+            lines.append(f"  {_format_size(stat.size)} in {stat.count} blocks: {self._site_str(stat.traceback)}")
+        if self.previous_snapshot is not None:
+            lines.extend(["", f"Biggest changes since the report at {self.previous_report_time:%Y-%m-%d %H:%M:%S}:"])
+            for stat in snapshot.compare_to(self.previous_snapshot, "lineno")[:TOP_SITES]:
+                lines.append(f"  {'+' if stat.size_diff >= 0 else '-'}{_format_size(abs(stat.size_diff))} "
+                             f"({stat.count_diff:+} blocks), {_format_size(stat.size)} now: "
+                             f"{self._site_str(stat.traceback)}")
+        self.previous_snapshot = snapshot
+        return lines
+
+    def report(self) -> List[str]:
+        """Returns the sections of the report"""
+        now = datetime.datetime.now()
+        sections = [f"Memory report at {now:%Y-%m-%d %H:%M:%S}",
+                    "\n".join(self.structures_report()),
+                    "\n".join(self.allocations_report())]
+        self.previous_report_time = now
+        return sections
@@ -0,0 +1,193 @@
+import asyncio
+import bisect
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics: Dict[str, "Metric"] = {}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base of the metric types. Label values are passed as keyword arguments and must always be the same set of
+    labels the metric was created with. Updating a metric is a dict lookup and an addition, so it is cheap enough for
+    hot paths."""
+    TYPE = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        if name in _metrics:
+            raise ValueError(f"Metric {name} already exists")
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        _metrics[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[label_name] for label_name in self.label_names)
+
+    def _labels_str(self, key: tuple, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if len(pairs) == 0:
+            return ""
+        return "{" + ",".join(f"{name}=\"{_escape(value)}\"" for name, value in pairs) + "}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def exposition(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"] + self.samples()
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self._labels_str(key)} {_format_value(value)}" for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """A value that goes up and down. Besides setting it, a function can be given that is called for the value every
+    time the metrics are read, which costs nothing until then."""
+    TYPE = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self.values: Dict[tuple, float] = {}
+        self.functions: Dict[tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        self.functions[self._key(labels)] = function
+
+    def samples(self) -> List[str]:
+        values = dict(self.values)
+        for key, function in self.functions.items():
+            try:
+                values[key] = function()
+            except Exception as e:
+                logging.warning(f"Could not read {self.name}: {e}")
+        return [f"{self.name}{self._labels_str(key)} {_format_value(value)}" for key, value in values.items()
+                if value is not None]
+
+
+class _Timer:
+    def __init__(self, histogram: "Histogram", labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (not cumulative, the last one is +Inf), sum, count]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        data = self.values.get(key)
+        if data is None:
+            data = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    def time(self, **labels) -> _Timer:
+        """Observes how long the with block takes"""
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (bucket_counts, total, count) in self.values.items():
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._labels_str(key, (('le', _format_value(upper_bound)),))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{self._labels_str(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._labels_str(key)} {count}")
+        return lines
+
+
+def exposition() -> str:
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics.values():
+        lines.extend(metric.exposition())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves the metrics over HTTP at /metrics. Only meant to listen on localhost for a local scraper."""
+    REQUEST_TIMEOUT = 5
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.server: asyncio.AbstractServer | None = None
+
+    async def start(self):
+        if self.server is None:
+            self.server = await asyncio.start_server(self._handle, self.host, self.port)
+            logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), MetricsServer.REQUEST_TIMEOUT)
+            # The headers are not needed, but have to be read before answering
+            while True:
+                line = await asyncio.wait_for(reader.readline(), MetricsServer.REQUEST_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", exposition().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
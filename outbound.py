@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Iterable
+import discord
+import shared
+
+
+class OutboundMessage:
+    def __init__(self, content: str, coalesce: bool):
+        self.content = content
+        self.coalesce = coalesce
+        self.futures: List[asyncio.Future] = [asyncio.get_running_loop().create_future()]
+        self.enqueued_at = time.monotonic()
+
+
+class ChannelOutbox:
+    def __init__(self, channel_id: int):
+        self.channel_id = channel_id
+        self.pending: deque[OutboundMessage] = deque()
+        self.worker: asyncio.Task | None = None
+        # Messages to a channel share a single Discord route bucket, so a 429 only blocks this channel
+        self.blocked_until = 0.0
+        self.rate_limited_count = 0
+
+
+class MessageDispatcher:
+    """Sends messages to channels without making the caller wait for Discord.
+
+    Each channel has its own FIFO outbox and worker, so a slow or rate limited channel only delays its own messages.
+    Messages that are queued for the same channel within COALESCE_WINDOW are combined into one message when they fit.
+    """
+    COALESCE_WINDOW = 0.5
+    MAX_CONCURRENT_SENDS = 10
+    MAX_SEND_ATTEMPTS = 3
+    LATENCY_SAMPLES = 200
+
+    def __init__(self, bot: discord.Client):
+        self.bot = bot
+        self.outboxes: Dict[int, ChannelOutbox] = {}
+        self.send_limiter = asyncio.Semaphore(MessageDispatcher.MAX_CONCURRENT_SENDS)
+        self.messages_sent = 0
+        self.messages_coalesced = 0
+        self.messages_failed = 0
+        self.latencies: deque[float] = deque(maxlen=MessageDispatcher.LATENCY_SAMPLES)
+
+    def send(self, channel_id: int, content: str, coalesce=True) -> asyncio.Future:
+        """Queues content to be sent to the channel. The returned future resolves to the sent discord.Message, or
+        None if it could not be sent. Pass coalesce=False for messages that will be edited later."""
+        outbox = self.outboxes.get(channel_id)
+        if outbox is None:
+            outbox = self.outboxes[channel_id] = ChannelOutbox(channel_id)
+        message = OutboundMessage(content, coalesce)
+        outbox.pending.append(message)
+        if outbox.worker is None or outbox.worker.done():
+            outbox.worker = asyncio.create_task(self._run_outbox(outbox))
+        return message.futures[0]
+
+    def send_to_many(self, channel_ids: Iterable[int], content: str, coalesce=True) -> List[asyncio.Future]:
+        return [self.send(channel_id, content, coalesce) for channel_id in channel_ids]
+
+    def _take_batch(self, outbox: ChannelOutbox) -> OutboundMessage:
+        batch = outbox.pending.popleft()
+        if not batch.coalesce:
+            return batch
+        while len(outbox.pending) > 0:
+            next_message = outbox.pending[0]
+            if not next_message.coalesce or \
+                    len(batch.content) + len(next_message.content) + 1 > shared.MAX_LEN:
+                break
+            outbox.pending.popleft()
+            batch.content = f"{batch.content}\n{next_message.content}"
+            batch.futures.extend(next_message.futures)
+            self.messages_coalesced += 1
+        return batch
+
+    async def _run_outbox(self, outbox: ChannelOutbox):
+        while len(outbox.pending) > 0:
+            if outbox.pending[0].coalesce:
+                await asyncio.sleep(MessageDispatcher.COALESCE_WINDOW)
+            batch = self._take_batch(outbox)
+            sent = None
+            try:
+                sent = await self._deliver(outbox, batch)
+            finally:
+                # Callers await these futures, they have to resolve even if the worker is cancelled
+                for future in batch.futures:
+                    if not future.done():
+                        future.set_result(sent)
+            if sent is not None:
+                self.latencies.append(time.monotonic() - batch.enqueued_at)
+
+    async def _deliver(self, outbox: ChannelOutbox, batch: OutboundMessage) -> discord.Message | None:
+        for _ in range(MessageDispatcher.MAX_SEND_ATTEMPTS):
+            wait_time = outbox.blocked_until - time.monotonic()
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+            channel = self.bot.get_channel(outbox.channel_id)
+            if channel is None:
+                logging.warning(f"Dropping outbound message for unknown channel {outbox.channel_id}")
+                break
+            try:
+                async with self.send_limiter:
+                    message = await channel.send(batch.content)
+                self.messages_sent += 1
+                return message
+            except discord.RateLimited as e:
+                outbox.rate_limited_count += 1
+                outbox.blocked_until = time.monotonic() + e.retry_after
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    logging.critical(f"Failed to send outbound message to channel {outbox.channel_id}:")
+                    logging.exception(e)
+                    break
+                outbox.rate_limited_count += 1
+                outbox.blocked_until = time.monotonic() + 1
+            except Exception as e:  # e.g. the connection dropped, the next message may still get through
+                logging.critical(f"Failed to send outbound message to channel {outbox.channel_id}:")
+                logging.exception(e)
+                break
+        self.messages_failed += 1
+        return None
+
+    def queue_depth(self) -> int:
+        return sum(len(outbox.pending) for outbox in self.outboxes.values())
+
+    def stats_str(self) -> str:
+        latencies = sorted(self.latencies)
+        if len(latencies) > 0:
+            average_latency = sum(latencies) / len(latencies)
+            latency_str = f"{average_latency:.2f}s average, {latencies[int(len(latencies) * .95)]:.2f}s p95, " \
+                          f"{latencies[-1]:.2f}s max (last {len(latencies)} messages)"
+        else:
+            latency_str = "No messages sent yet"
+        rate_limited = sum(outbox.rate_limited_count for outbox in self.outboxes.values())
+        return f"Queue depth: {self.queue_depth()} messages in {len(self.outboxes)} channels\n" \
+               f"Send latency: {latency_str}\n" \
+               f"Sent: {self.messages_sent}, coalesced: {self.messages_coalesced}, failed: {self.messages_failed}, " \
+               f"rate limited: {rate_limited}"
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import metrics
+import os
+import pickle
+import tempfile
+import time
+from collections import deque
+from typing import Any, Callable, Dict
+
+Snapshot = Callable[[], Any]
+
+WRITE_SECONDS = metrics.Histogram("queuebot_persistence_write_seconds", "Time taken to snapshot and write a save file",
+                                  ["file"])
+BYTES_WRITTEN = metrics.Counter("queuebot_persistence_bytes_written_total", "Bytes written to save files", ["file"])
+FAILED_WRITES = metrics.Counter("queuebot_persistence_failed_writes_total", "Save file writes that failed", ["file"])
+
+
+def write_atomic(path: str, data: bytes):
+    """Writes data to a temporary file next to path, syncs it to disk and renames it over path, so path always holds
+    either the old or the new contents, even if the process dies mid-write"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def serialize_and_write(path: str, snapshot: Any) -> int:
+    data = snapshot if isinstance(snapshot, bytes) else pickle.dumps(snapshot)
+    write_atomic(path, data)
+    return len(data)
+
+
+class PersistenceWriter:
+    """Writes pickled state to disk in a worker thread, off of the event loop.
+
+    Modules register a file with a snapshot function and call mark_dirty whenever the state behind it changes. Writes
+    for a dirty file are delayed by WRITE_WINDOW seconds so bursts of changes turn into one write. The snapshot
+    function is called on the event loop and must return an object that nothing else will mutate (or already pickled
+    bytes), since it is pickled in another thread.
+
+    A file is only written after mark_loaded has been called for it, once its saved contents have been applied. Until
+    then the state in memory is empty or partial, and writing it would overwrite the save with it."""
+    WRITE_WINDOW = 2.0
+    LATENCY_SAMPLES = 100
+
+    def __init__(self):
+        self.snapshots: Dict[str, Snapshot] = {}
+        self.dirty = set()
+        self.loaded = set()
+        self.closed = False
+        self.flush_task: asyncio.Task | None = None
+        self.write_lock = asyncio.Lock()
+        self.writes = 0
+        self.failed_writes = 0
+        self.bytes_written = 0
+        self.latencies: deque[float] = deque(maxlen=PersistenceWriter.LATENCY_SAMPLES)
+
+    def register(self, path: str, snapshot: Snapshot):
+        self.snapshots[path] = snapshot
+
+    def mark_loaded(self, path: str):
+        self.loaded.add(path)
+
+    def mark_dirty(self, path: str):
+        self.dirty.add(path)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:  # Not running yet, the next flush will pick it up
+            return
+        if self.closed:
+            return
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Files marked dirty while a write was going on are still dirty afterwards, they get another window
+        while len(self.dirty) > 0:
+            await asyncio.sleep(PersistenceWriter.WRITE_WINDOW)
+            await self.flush()
+
+    async def flush(self, paths=None):
+        """Writes the given registered files now, or every dirty file if paths is None"""
+        async with self.write_lock:
+            to_write = set(self.dirty) if paths is None else set(paths)
+            self.dirty.difference_update(to_write)
+            for path in to_write:
+                if path not in self.loaded:
+                    logging.warning(f"Not writing {path}, its saved data was never loaded")
+                    continue
+                started = time.perf_counter()
+                try:
+                    snapshot = self.snapshots[path]()
+                    written = await asyncio.to_thread(serialize_and_write, path, snapshot)
+                except Exception as e:
+                    self.failed_writes += 1
+                    FAILED_WRITES.inc(file=path)
+                    logging.critical(f"Failed to write {path}:")
+                    logging.exception(e)
+                    continue
+                self.writes += 1
+                self.bytes_written += written
+                self.latencies.append(time.perf_counter() - started)
+                WRITE_SECONDS.observe(self.latencies[-1], file=path)
+                BYTES_WRITTEN.inc(written, file=path)
+
+    async def flush_all(self):
+        await self.flush(list(self.snapshots))
+
+    async def close(self):
+        """Writes the dirty files now and stops the delayed flush, for shutting down. Only does anything the first time
+        it is called."""
+        if self.closed:
+            return
+        self.closed = True
+        # A write already in progress finishes first, the lock makes this flush wait for it
+        await self.flush()
+        if self.flush_task is not None and not self.flush_task.done():
+            self.flush_task.cancel()
+
+    def stats_str(self) -> str:
+        not_loaded = set(self.snapshots) - self.loaded
+        latencies = sorted(self.latencies)
+        if len(latencies) > 0:
+            latency_str = f"{sum(latencies) / len(latencies) * 1000:.1f}ms average, " \
+                          f"{latencies[-1] * 1000:.1f}ms max (last {len(latencies)} writes)"
+        else:
+            latency_str = "No writes yet"
+        return f"Writes: {self.writes}, failed: {self.failed_writes}, bytes written: {self.bytes_written}\n" \
+               f"Write latency: {latency_str}\n" \
+               f"Dirty: {', '.join(sorted(self.dirty)) if len(self.dirty) > 0 else 'nothing'}\n" \
+               f"Not loaded, so not written: {', '.join(sorted(not_loaded)) if len(not_loaded) > 0 else 'nothing'}"
+
+
+writer = PersistenceWriter()
@@ -0,0 +1,134 @@
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import time
+from typing import Awaitable, Callable
+
+ROUTINE_TICK = "routine tick"
+INTERACTION = "interaction"
+
+REPORT_FILE = "profile_report.txt"
+STATS_FILE = "profile.pstats"
+REPORT_LINES = 60
+
+# on_finished(summary, report file, raw stats file or None if nothing was profiled)
+OnFinished = Callable[[str, str, str | None], Awaitable]
+
+
+class Profiler:
+    """Profiles the next few routine ticks and/or interactions with cProfile, then switches itself off and hands the
+    results to a callback.
+
+    Only the time spent inside the profiled ticks and interactions is profiled, but everything else the event loop
+    runs in the meantime shows up too, since they await. Work done in worker threads doesn't show up. A capture that
+    hasn't finished after MAX_CAPTURE_SECONDS (e.g. because no interactions came in) is finished with what it has."""
+    MAX_CAPTURE_SECONDS = 30 * 60
+
+    def __init__(self):
+        self.profile: cProfile.Profile | None = None
+        self.ticks_left = 0
+        self.interactions_left = 0
+        self.ticks_profiled = 0
+        self.interactions_profiled = 0
+        self.active = 0
+        self.profiled_seconds = 0.0
+        self.enabled_at = 0.0
+        self.started_at = 0.0
+        self.on_finished: OnFinished | None = None
+        self.timeout_task: asyncio.Task | None = None
+
+    def is_capturing(self) -> bool:
+        return self.profile is not None
+
+    def start(self, ticks: int, interactions: int, on_finished: OnFinished) -> bool:
+        """Profiles the next ticks routine ticks and interactions interactions. Returns False if a capture is already
+        going on."""
+        if self.is_capturing() or ticks + interactions <= 0:
+            return False
+        self.profile = cProfile.Profile()
+        self.ticks_left, self.interactions_left = ticks, interactions
+        self.ticks_profiled = self.interactions_profiled = 0
+        self.profiled_seconds = 0.0
+        self.started_at = time.perf_counter()
+        self.on_finished = on_finished
+        self.timeout_task = asyncio.create_task(self._finish_later())
+        return True
+
+    def _claim(self, kind: str) -> bool:
+        if not self.is_capturing():
+            return False
+        if kind == ROUTINE_TICK and self.ticks_left > 0:
+            self.ticks_left -= 1
+            self.ticks_profiled += 1
+            return True
+        if kind == INTERACTION and self.interactions_left > 0:
+            self.interactions_left -= 1
+            self.interactions_profiled += 1
+            return True
+        return False
+
+    async def run(self, kind: str, run_profiled: Callable[[], Awaitable]):
+        """Runs run_profiled, under the profiler if the capture still wants this kind of work"""
+        if not self._claim(kind):
+            return await run_profiled()
+        profile = self.profile
+        # Ticks and interactions can overlap, the profiler stays on until the last of them is done
+        if self.active == 0:
+            self.enabled_at = time.perf_counter()
+            profile.enable()
+        self.active += 1
+        try:
+            return await run_profiled()
+        finally:
+            self.active -= 1
+            if self.active == 0:
+                profile.disable()
+                self.profiled_seconds += time.perf_counter() - self.enabled_at
+                if self.ticks_left == 0 and self.interactions_left == 0:
+                    self._finish()
+
+    async def _finish_later(self):
+        await asyncio.sleep(Profiler.MAX_CAPTURE_SECONDS)
+        self.ticks_left = self.interactions_left = 0
+        if self.active == 0:
+            self._finish()
+
+    def _finish(self):
+        profile, on_finished = self.profile, self.on_finished
+        if profile is None:
+            return
+        self.profile = None
+        self.on_finished = None
+        if self.timeout_task is not None and self.timeout_task is not asyncio.current_task():
+            self.timeout_task.cancel()
+
+        summary = f"Profiled {self.ticks_profiled} routine tick(s) and {self.interactions_profiled} " \
+                  f"interaction(s): {self.profiled_seconds:.2f}s profiled over " \
+                  f"{time.perf_counter() - self.started_at:.0f}s"
+        report = io.StringIO()
+        report.write(summary + "\n\n")
+        stats_file = None
+        try:
+            stats = pstats.Stats(profile, stream=report)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_LINES)
+            stats.sort_stats(pstats.SortKey.TIME).print_stats(REPORT_LINES)
+            stats.dump_stats(STATS_FILE)
+            stats_file = STATS_FILE
+        except TypeError:  # Nothing was profiled, pstats has no data to work with
+            report.write("Nothing ran while the profiler was on.\n")
+        with open(REPORT_FILE, "w") as f:
+            f.write(report.getvalue())
+        asyncio.create_task(self._deliver(on_finished, summary, stats_file))
+
+    @staticmethod
+    async def _deliver(on_finished: OnFinished, summary: str, stats_file: str | None):
+        try:
+            await on_finished(summary, REPORT_FILE, stats_file)
+        except Exception as e:
+            logging.critical("Failed to deliver the profile:")
+            logging.exception(e)
+
+
+profiler = Profiler()
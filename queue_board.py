@@ -0,0 +1,58 @@
+import time
+from typing import Dict, List, Tuple
+import game_queue
+import shared
+
+
+class QueueBoard:
+    """The pages /list shows for a queue.
+
+    Pages are cached against the queue version and rendered again at most once every MIN_RENDER_INTERVAL seconds, so
+    how often /list is used doesn't change how often the queue is rendered. Each player's line is kept between renders
+    and only built again when something shown in it changed."""
+    MIN_RENDER_INTERVAL = 2.0
+
+    def __init__(self, queue: game_queue.Queue, ladder_type: str):
+        self.queue = queue
+        self.ladder_type = ladder_type
+        self.pages: List[str] = []
+        self.rendered_version = None
+        self.rendered_at = float("-inf")
+        self.lines: Dict[int, Tuple[tuple, str]] = {}  # id(player) -> (what the line shows, line)
+        self.renders = 0
+
+    def get_pages(self) -> List[str]:
+        if self.rendered_version != self.queue.version \
+                and time.monotonic() - self.rendered_at >= QueueBoard.MIN_RENDER_INTERVAL:
+            self.render()
+        return self.pages
+
+    def get_line(self, player: game_queue.Player, group_number: int | None) -> str:
+        shown = (player.name, player.mmr, group_number, player.can_host)
+        cached = self.lines.get(id(player))
+        if cached is not None and cached[0] == shown:
+            return cached[1]
+        line = f"{player.name} ({player.mmr} MMR)"
+        if group_number is not None:
+            line += f" (group #{group_number})"
+        if player.can_host:
+            line += " - host"
+        self.lines[id(player)] = (shown, line)
+        return line
+
+    def render(self):
+        self.rendered_version = self.queue.version
+        self.rendered_at = time.monotonic()
+        self.renders += 1
+        players = self.queue.get_players_with_group_numbers()
+        if len(players) == 0:
+            self.lines.clear()
+            self.pages = [f"No players in the {self.ladder_type.upper()} queue."]
+            return
+        lines = [f"{self.ladder_type.upper()} queue:"]
+        lines.extend(f"{index}. {self.get_line(player, group_number)}"
+                     for index, (group_number, player) in enumerate(players, 1))
+        # Forget the lines of players who left
+        queued = {id(player) for _, player in players}
+        self.lines = {entry: cached for entry, cached in self.lines.items() if entry in queued}
+        self.pages = shared.split_large_str("\n".join(lines))
@@ -3,12 +3,22 @@ import datetime
 import pickle
 import logging
 import game_queue
+import metrics
+import persistence
+import time
+from collections import defaultdict
+from typing import Dict
 
-RT_MMR_DATA = {}
-CT_MMR_DATA = {}
-last_pull_time_rt = None
-last_pull_time_ct = None
+# Rating table of each ladder: queue key -> (name, discord id, mmr, lr)
+MMR_DATA: Dict[str, dict] = defaultdict(dict)
+last_pull_times: Dict[str, datetime.datetime] = {}
 minimum_time_before_pull = datetime.timedelta(minutes=15)
+RATING_DATA_FILE = "rating_pkl"
+
+PULL_SECONDS = metrics.Histogram("queuebot_rating_pull_seconds", "Time taken to pull and rebuild a rating table",
+                                 ["ladder"], buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+PULL_FAILURES = metrics.Counter("queuebot_rating_pull_failures_total", "Rating pulls that got no response",
+                                ["ladder"])
 
 PLAYER_NAME_FIELD_NAME = "player_name"
 PLAYER_ID_FIELD_NAME = "player_id"
@@ -17,25 +27,26 @@ PLAYER_MMR_FIELD_NAME = "current_mmr"
 PLAYER_LR_FIELD_NAME = "current_lr"
 
 
+def get_mmr_data(ladder_type: str) -> dict:
+    return MMR_DATA[ladder_type]
+
+
 async def pull_mmr_data(ladder_type: str):
-    global last_pull_time_rt, last_pull_time_ct
     mmr_api_link = f"https://mkwlounge.gg/api/ladderplayer.php?ladder_type={ladder_type}&all&fields=" \
                    f"{PLAYER_NAME_FIELD_NAME},{PLAYER_ID_FIELD_NAME},{PLAYER_MMR_FIELD_NAME}," \
                    f"{PLAYER_LR_FIELD_NAME},{PLAYER_DISCORD_ID_FIELD_NAME}"
     cur_time = datetime.datetime.now()
-    last_pull_time = last_pull_time_rt if ladder_type == shared.RT_LADDER else last_pull_time_ct
+    last_pull_time = last_pull_times.get(ladder_type)
     if last_pull_time is not None and cur_time < (last_pull_time + minimum_time_before_pull):
         return
 
+    pull_started = time.perf_counter()
     response = await shared.get_json_data(mmr_api_link)
     if response is None:
+        PULL_FAILURES.inc(ladder=ladder_type)
         return
-    if ladder_type == shared.RT_LADDER:
-        mmr_data = RT_MMR_DATA
-        last_pull_time_rt = cur_time
-    else:
-        mmr_data = CT_MMR_DATA
-        last_pull_time_ct = cur_time
+    mmr_data = get_mmr_data(ladder_type)
+    last_pull_times[ladder_type] = cur_time
 
     mmr_data.clear()
     for player in response['results']:
@@ -44,10 +55,12 @@ async def pull_mmr_data(ladder_type: str):
                                                     player[PLAYER_DISCORD_ID_FIELD_NAME],
                                                     player[PLAYER_MMR_FIELD_NAME],
                                                     player[PLAYER_LR_FIELD_NAME])
+    PULL_SECONDS.observe(time.perf_counter() - pull_started, ladder=ladder_type)
+    save_data()
 
 
 def get_player_rating(player: str | int, ladder_type: str):
-    mmr_data = RT_MMR_DATA if ladder_type == shared.RT_LADDER else CT_MMR_DATA
+    mmr_data = get_mmr_data(ladder_type)
     lookup = player
     if isinstance(player, str):
         return mmr_data.get(lookup, None)
@@ -57,26 +70,51 @@ def get_player_rating(player: str | int, ladder_type: str):
                 return data
 
 
+def get_save_snapshot():
+    # The rating tuples are never mutated, so shallow copies of the dicts are safe to pickle in another thread
+    return {"MMR_DATA": {ladder_type: dict(mmr_data) for ladder_type, mmr_data in MMR_DATA.items()},
+            "last_pull_times": dict(last_pull_times)}
+
+
 def save_data():
-    to_dump = {"RT_MMR_DATA": RT_MMR_DATA,
-               "CT_MMR_DATA": CT_MMR_DATA,
-               "last_pull_time_rt": last_pull_time_rt,
-               "last_pull_time_ct": last_pull_time_ct}
-    with open("rating_pkl", "wb") as f:
-        pickle.dump(to_dump, f)
+    """Schedules the rating data to be written to disk in the background"""
+    persistence.writer.mark_dirty(RATING_DATA_FILE)
+
 
+persistence.writer.register(RATING_DATA_FILE, get_save_snapshot)
 
-def load_data():
+
+def read_data():
+    """Reads the saved rating data without applying it. Safe to call from a worker thread."""
     try:
-        with open("rating_pkl", "rb") as f:
-            to_load = pickle.load(f)
-            RT_MMR_DATA.clear()
-            RT_MMR_DATA.update(to_load["RT_MMR_DATA"])
-            CT_MMR_DATA.clear()
-            CT_MMR_DATA.update(to_load["CT_MMR_DATA"])
-            global last_pull_time_rt, last_pull_time_ct
-            last_pull_time_rt = to_load["last_pull_time_rt"]
-            last_pull_time_ct = to_load["last_pull_time_ct"]
+        with open(RATING_DATA_FILE, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:  # Nothing saved yet, there's nothing to lose by writing it
+        return {"MMR_DATA": {}, "last_pull_times": {}}
     except Exception as e:
         logging.critical("Failed to load rating pickle:")
         logging.critical(e)
+
+
+def apply_data(to_load: dict | None):
+    """Applies read_data's result. The rating file is only written afterwards if this succeeded."""
+    if to_load is None:
+        return
+    try:
+        if "MMR_DATA" in to_load:
+            mmr_datas, pull_times = to_load["MMR_DATA"], to_load["last_pull_times"]
+        else:  # Older saves only had the RT and CT ladders
+            mmr_datas = {shared.RT_LADDER: to_load["RT_MMR_DATA"], shared.CT_LADDER: to_load["CT_MMR_DATA"]}
+            pull_times = {shared.RT_LADDER: to_load["last_pull_time_rt"],
+                          shared.CT_LADDER: to_load["last_pull_time_ct"]}
+        for ladder_type, mmr_data in mmr_datas.items():
+            get_mmr_data(ladder_type).clear()
+            get_mmr_data(ladder_type).update(mmr_data)
+        last_pull_times.clear()
+        last_pull_times.update({ladder_type: pull_time for ladder_type, pull_time in pull_times.items()
+                                if pull_time is not None})
+    except Exception as e:
+        logging.critical("Failed to load rating pickle:")
+        logging.critical(e)
+        return
+    persistence.writer.mark_loaded(RATING_DATA_FILE)
@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, Set
+
+
+class RoomChannelPool:
+    """Keeps track of the free text channels in each room category so a room can get a channel in O(1).
+
+    Channel ids move between the category's free set and in_use as rooms start and end. The pool has to be told
+    about channels being created, deleted or moved, and should be rebuilt when the room categories change."""
+
+    def __init__(self):
+        self.free: Dict[int, OrderedDict[int, None]] = {}
+        self.channel_categories: Dict[int, int] = {}
+        self.in_use: Set[int] = set()
+
+    def rebuild(self, categories: Dict[int, Iterable[int]], in_use: Iterable[int]):
+        """categories maps each room category id to the ids of its text channels, in order"""
+        self.free.clear()
+        self.channel_categories.clear()
+        self.in_use = set(in_use)
+        for category_id, channel_ids in categories.items():
+            self.free[category_id] = OrderedDict()
+            for channel_id in channel_ids:
+                self.add_channel(category_id, channel_id)
+
+    def add_channel(self, category_id: int, channel_id: int):
+        if category_id not in self.free:
+            return
+        self.channel_categories[channel_id] = category_id
+        if channel_id not in self.in_use:
+            self.free[category_id][channel_id] = None
+
+    def remove_channel(self, channel_id: int):
+        category_id = self.channel_categories.pop(channel_id, None)
+        if category_id is not None:
+            self.free[category_id].pop(channel_id, None)
+
+    def acquire(self, category_id: int) -> int | None:
+        free_channels = self.free.get(category_id)
+        if not free_channels:
+            return None
+        channel_id, _ = free_channels.popitem(last=False)
+        self.in_use.add(channel_id)
+        return channel_id
+
+    def release(self, channel_id: int | None):
+        if channel_id is None or channel_id not in self.in_use:
+            return
+        self.in_use.remove(channel_id)
+        category_id = self.channel_categories.get(channel_id)
+        if category_id is not None:
+            self.free[category_id][channel_id] = None
+
+    def count_free(self, category_id: int) -> int:
+        return len(self.free.get(category_id, ()))
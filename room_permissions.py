@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple
+import discord
+
+
+class PermissionManager:
+    """Applies room channel visibility with as few API calls as possible.
+
+    The overwrites a room channel should have are compared with the ones it already has. Nothing is sent if they are
+    the same, a couple of set_permissions calls are sent if only a couple of targets differ, and one full edit is sent
+    otherwise. set_permissions only takes members and roles, so changes involving a bare Object (a player missing from
+    the member cache, or an overwrite for a member who left) always go through the full edit, which takes typed
+    Objects. Edits to the same channel are serialized, and edits across channels run concurrently up to
+    MAX_CONCURRENT_EDITS at a time."""
+    MAX_CONCURRENT_EDITS = 5
+    # Above this many changed targets, a single full edit is cheaper than one call per target
+    MAX_SINGLE_TARGET_EDITS = 2
+    # Members of running rooms are all that needs remembering, rooms forget their players when they end
+    MAX_CACHED_MEMBERS = 500
+
+    def __init__(self):
+        self.edit_limiter = asyncio.Semaphore(PermissionManager.MAX_CONCURRENT_EDITS)
+        self.channel_locks: Dict[int, asyncio.Lock] = {}
+        self.members: OrderedDict[int, discord.Member] = OrderedDict()
+        self.edits_skipped = 0
+        self.edits_sent = 0
+
+    def get_target(self, guild: discord.Guild, discord_id: int) -> discord.abc.Snowflake:
+        """Resolves a player to an overwrite target, remembering the member so a room doesn't resolve the same players
+        again at the end. Falls back to an Object typed as a member so players missing from the member cache still get
+        access through a full edit. The fallback isn't remembered, the member may be cached by the next edit."""
+        member = self.members.get(discord_id)
+        if member is not None:
+            self.members.move_to_end(discord_id)
+            return member
+        member = guild.get_member(discord_id)
+        if member is None:
+            return discord.Object(id=discord_id, type=discord.Member)
+        self.members[discord_id] = member
+        if len(self.members) > PermissionManager.MAX_CACHED_MEMBERS:
+            self.members.popitem(last=False)
+        return member
+
+    def forget_members(self, discord_ids: Iterable[int]):
+        for discord_id in discord_ids:
+            self.members.pop(discord_id, None)
+
+    def get_desired_overwrites(self, channel: discord.TextChannel, player_ids: Iterable[int], view: bool) \
+            -> Dict[int, Tuple[discord.abc.Snowflake, discord.PermissionOverwrite]]:
+        guild = channel.guild
+        desired = {guild.default_role.id: (guild.default_role, discord.PermissionOverwrite(view_channel=False)),
+                   guild.me.id: (guild.me, discord.PermissionOverwrite(view_channel=True))}
+        for player_id in player_ids:
+            if player_id:
+                target = self.get_target(guild, player_id)
+                desired[target.id] = (target, discord.PermissionOverwrite(view_channel=view))
+        # The category's own overwrites always win
+        if channel.category is not None:
+            for target, overwrite in channel.category.overwrites.items():
+                desired[target.id] = (target, overwrite)
+        return desired
+
+    async def set_visibility(self, channel: discord.TextChannel, player_ids: Iterable[int], view: bool):
+        desired = self.get_desired_overwrites(channel, player_ids, view)
+        lock = self.channel_locks.setdefault(channel.id, asyncio.Lock())
+        async with lock:
+            current = {target.id: (target, overwrite) for target, overwrite in channel.overwrites.items()}
+            to_set = [(target, overwrite) for target_id, (target, overwrite) in desired.items()
+                      if target_id not in current or current[target_id][1] != overwrite]
+            to_remove = [target for target_id, (target, _) in current.items() if target_id not in desired]
+            if len(to_set) + len(to_remove) == 0:
+                self.edits_skipped += 1
+                return
+            targets = [target for target, _ in to_set] + to_remove
+            per_target = len(targets) <= PermissionManager.MAX_SINGLE_TARGET_EDITS and \
+                not any(isinstance(target, discord.Object) for target in targets)
+            async with self.edit_limiter:
+                if per_target:
+                    for target, overwrite in to_set:
+                        await channel.set_permissions(target, overwrite=overwrite)
+                    for target in to_remove:
+                        await channel.set_permissions(target, overwrite=None)
+                else:
+                    await channel.edit(overwrites={target: overwrite for target, overwrite in desired.values()})
+            self.edits_sent += 1
+            logging.info(f"Changed {len(to_set)} and removed {len(to_remove)} overwrites in {channel.id}")
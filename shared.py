@@ -6,11 +6,18 @@ RT_LADDER = "rt"
 CT_LADDER = "ct"
 WARN_DROP_TIME = 1000000000
 AUTO_DROP_TIME = 10000000000
+# Seconds one run of the periodic routines may take before it is logged as slow and non-critical work is put off
+ROUTINE_TICK_BUDGET = 5
+# Port the metrics are served on at http://127.0.0.1:<port>/metrics, None to not serve them
+METRICS_PORT = 9108
+# Whether the periodic routines put off non-critical work while the event loop is lagging
+SHED_ON_LOOP_LAG = False
+# Whether to trace allocations from startup for /memory-report, which costs memory and CPU for the whole run.
+# Otherwise tracing starts with the first report.
+TRACE_MEMORY_AT_STARTUP = False
 OWNERS = [1110408991839883274]
 
 
-RUN_UNIT_TESTS = True
-
 TESTING = True
 if TESTING:
     LOUNGE_GUILD_ID = 1112604633454628864
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Iterable
+import discord
+import outbound
+
+
+class StatusMessageBoard:
+    """Keeps a single pinned status message in each queue channel up to date.
+
+    A channel's message is only edited when the content it should show differs from what it last showed, and at most
+    once every MIN_EDIT_INTERVAL seconds; changes in between are folded into one delayed edit of the latest content.
+    A new message is only sent (and pinned) when the channel has none yet or its message was deleted. The message ids
+    are saved with the main data so a restart keeps editing the same messages."""
+    MIN_EDIT_INTERVAL = 10
+
+    def __init__(self, dispatcher: outbound.MessageDispatcher, on_message_ids_changed: Callable[[], None]):
+        self.dispatcher = dispatcher
+        self.on_message_ids_changed = on_message_ids_changed
+        self.message_ids: Dict[int, int] = {}  # channel id -> status message id
+        self.shown: Dict[int, str] = {}  # channel id -> content the status message currently has
+        self.wanted: Dict[int, str] = {}  # channel id -> content the status message should have
+        self.last_edited: Dict[int, float] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+        self.edits_sent = 0
+        self.edits_skipped = 0
+
+    def load(self, message_ids: Dict[int, int]):
+        self.message_ids = dict(message_ids)
+        self.shown.clear()
+
+    def forget_channel(self, channel_id: int):
+        """Stops updating the channel's status message, e.g. when it is no longer a queue channel"""
+        self.wanted.pop(channel_id, None)
+        self.shown.pop(channel_id, None)
+        if self.message_ids.pop(channel_id, None) is not None:
+            self.on_message_ids_changed()
+
+    def update(self, channel_ids: Iterable[int], content: str):
+        """Makes the status messages of the channels show content soon. Returns without waiting for Discord."""
+        for channel_id in channel_ids:
+            self.wanted[channel_id] = content
+            if self.shown.get(channel_id) == content:
+                self.edits_skipped += 1
+                continue
+            worker = self.workers.get(channel_id)
+            if worker is None or worker.done():
+                self.workers[channel_id] = asyncio.create_task(self._update_channel(channel_id))
+
+    async def _update_channel(self, channel_id: int):
+        while channel_id in self.wanted and self.shown.get(channel_id) != self.wanted[channel_id]:
+            wait = self.last_edited.get(channel_id, 0.0) + StatusMessageBoard.MIN_EDIT_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            content = self.wanted[channel_id]
+            self.last_edited[channel_id] = time.monotonic()
+            try:
+                await self._show(channel_id, content)
+            except Exception as e:
+                logging.critical(f"Failed to update the status message in {channel_id}:")
+                logging.exception(e)
+                return
+
+    async def _show(self, channel_id: int, content: str):
+        message_id = self.message_ids.get(channel_id)
+        if message_id is not None:
+            channel = self.dispatcher.bot.get_channel(channel_id)
+            if channel is None:
+                return
+            try:
+                await channel.get_partial_message(message_id).edit(content=content)
+                self.shown[channel_id] = content
+                self.edits_sent += 1
+                return
+            except discord.NotFound:  # Someone deleted it, send a new one below
+                self.message_ids.pop(channel_id, None)
+
+        message = await self.dispatcher.send(channel_id, content, coalesce=False)
+        if message is None:
+            return
+        self.message_ids[channel_id] = message.id
+        self.shown[channel_id] = content
+        self.on_message_ids_changed()
+        try:
+            await message.pin()
+        except discord.HTTPException:
+            logging.warning(f"Could not pin the status message in {channel_id}")
+
+    def stats_str(self) -> str:
+        return f"Status messages: {len(self.message_ids)}, edits sent: {self.edits_sent}, " \
+               f"unchanged updates skipped: {self.edits_skipped}"
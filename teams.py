@@ -0,0 +1,148 @@
+import bisect
+import random
+import time
+from typing import Callable, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+MAX_ATTEMPTS_WITHOUT_IMPROVEMENT = 200
+
+
+def _subset_sums_by_size(values: List[int]) -> List[List[Tuple[int, int]]]:
+    """Returns, for every subset size, the (sum, bitmask) of every subset of values with that size"""
+    by_size = [[] for _ in range(len(values) + 1)]
+    by_size[0].append((0, 0))
+    for index, value in enumerate(values):
+        bit = 1 << index
+        for size in range(index, -1, -1):
+            by_size[size + 1].extend((subset_sum + value, mask | bit) for subset_sum, mask in by_size[size])
+    return by_size
+
+
+def split_even_halves(players: List[T], key: Callable[[T], int]) -> Tuple[List[T], List[T]]:
+    """Splits players into a team of len(players) // 2 players and a team of the rest so that the difference between
+    the sums of key over both teams is as small as possible. The result is exact.
+
+    Meet in the middle: the subset sums of each half of the players are computed separately (2 * 2^(n/2) subsets
+    instead of n choose n/2 teams), then for every subset of the first half, the subset of the second half that
+    completes the team best is found with a binary search over its sorted sums."""
+    players = list(players)
+    team_size = len(players) // 2
+    values = [key(p) for p in players]
+    total = sum(values)
+    left_values, right_values = values[:len(values) // 2], values[len(values) // 2:]
+    left_subsets = _subset_sums_by_size(left_values)
+    right_subsets = [sorted(subsets) for subsets in _subset_sums_by_size(right_values)]
+    right_sums = [[subset_sum for subset_sum, _ in subsets] for subsets in right_subsets]
+
+    best = None  # (difference, left mask, right mask)
+    for left_size, subsets in enumerate(left_subsets):
+        right_size = team_size - left_size
+        if right_size < 0 or right_size >= len(right_subsets):
+            continue
+        sums = right_sums[right_size]
+        for left_sum, left_mask in subsets:
+            # The team sum should be as close as possible to total / 2, i.e. 2 * (left_sum + right_sum) ~ total
+            position = bisect.bisect_left(sums, (total - 2 * left_sum) / 2)
+            for candidate in (position - 1, position):
+                if 0 <= candidate < len(sums):
+                    difference = abs(2 * (left_sum + sums[candidate]) - total)
+                    if best is None or difference < best[0]:
+                        best = (difference, left_mask, right_subsets[right_size][candidate][1])
+        if best is not None and best[0] <= total % 2:  # Can't do better than this
+            break
+
+    _, left_mask, right_mask = best
+    offset = len(left_values)
+    chosen = {i for i in range(len(left_values)) if left_mask & (1 << i)} | \
+             {offset + i for i in range(len(right_values)) if right_mask & (1 << i)}
+    first_team = [p for i, p in enumerate(players) if i in chosen]
+    second_team = [p for i, p in enumerate(players) if i not in chosen]
+    return first_team, second_team
+
+
+def _team_sums(teams: List[List[T]], key: Callable[[T], int]) -> List[int]:
+    return [sum(key(p) for p in team) for team in teams]
+
+
+def make_balanced_teams(players: List[T], team_size: int, key: Callable[[T], int],
+                        time_budget: float = 0.05) -> Tuple[List[List[T]], int]:
+    """Splits players into teams of team_size players (the last team gets the remainder) with total key values as
+    close to each other as possible. Returns the teams and their spread, the difference between the highest and
+    lowest team totals.
+
+    Two teams are split exactly with split_even_halves. For more teams, every player is given to the team with the
+    lowest total that still has room, from the highest value down, then the teams are refined by swapping players
+    (local search with random restarts) for at most time_budget seconds."""
+    players = list(players)
+    if team_size <= 1 or len(players) <= team_size:
+        result = [players[i:i + max(team_size, 1)] for i in range(0, len(players), max(team_size, 1))]
+        sums = _team_sums(result, key)
+        return result, (max(sums) - min(sums)) if len(sums) > 0 else 0
+    num_teams = (len(players) + team_size - 1) // team_size
+    if num_teams == 2 and len(players) == 2 * team_size:
+        result = list(split_even_halves(players, key))
+        sums = _team_sums(result, key)
+        return result, abs(sums[0] - sums[1])
+
+    deadline = time.perf_counter() + time_budget
+    capacities = [team_size] * num_teams
+    capacities[-1] = len(players) - team_size * (num_teams - 1)
+    result = [[] for _ in range(num_teams)]
+    sums = [0] * num_teams
+    for player in sorted(players, key=key, reverse=True):
+        open_teams = [i for i in range(num_teams) if len(result[i]) < capacities[i]]
+        team_index = min(open_teams, key=lambda i: sums[i])
+        result[team_index].append(player)
+        sums[team_index] += key(player)
+    _improve_by_swapping(result, sums, key)
+
+    # Swapping alone gets stuck in local optima, so keep kicking the best teams found with a few random swaps and
+    # improving them again until the time is up or the kicks stop helping
+    best_teams, best_sums = [list(team) for team in result], list(sums)
+    rng = random.Random()
+    attempts_without_improvement = 0
+    while max(best_sums) - min(best_sums) > 0 and time.perf_counter() < deadline \
+            and attempts_without_improvement < MAX_ATTEMPTS_WITHOUT_IMPROVEMENT:
+        result, sums = [list(team) for team in best_teams], list(best_sums)
+        for _ in range(rng.randint(1, 3)):
+            high, low = rng.sample(range(num_teams), 2)
+            i, j = rng.randrange(len(result[high])), rng.randrange(len(result[low]))
+            d = key(result[high][i]) - key(result[low][j])
+            result[high][i], result[low][j] = result[low][j], result[high][i]
+            sums[high] -= d
+            sums[low] += d
+        _improve_by_swapping(result, sums, key)
+        spread, best_spread = max(sums) - min(sums), max(best_sums) - min(best_sums)
+        attempts_without_improvement = 0 if spread < best_spread else attempts_without_improvement + 1
+        if spread <= best_spread:  # Moving between equally good teams helps get off of plateaus
+            best_teams, best_sums = result, sums
+
+    return best_teams, max(best_sums) - min(best_sums)
+
+
+def _improve_by_swapping(teams: List[List[T]], sums: List[int], key: Callable[[T], int]):
+    """Swaps players between teams in place for as long as a swap brings two team totals closer together"""
+    while True:
+        # Best swap over all pairs of teams: moving a value difference of d between teams whose totals differ by
+        # gap (d < gap) reduces the sum of squared totals by 2 * d * (gap - d)
+        best = None  # (gain, high team, high player index, low team, low player index, d)
+        for high in range(len(teams)):
+            for low in range(len(teams)):
+                gap = sums[high] - sums[low]
+                if gap <= 0:
+                    continue
+                for i, high_player in enumerate(teams[high]):
+                    high_value = key(high_player)
+                    for j, low_player in enumerate(teams[low]):
+                        d = high_value - key(low_player)
+                        if 0 < d < gap:
+                            gain = d * (gap - d)
+                            if best is None or gain > best[0]:
+                                best = (gain, high, i, low, j, d)
+        if best is None:
+            return
+        _, high, i, low, j, d = best
+        teams[high][i], teams[low][j] = teams[low][j], teams[high][i]
+        sums[high] -= d
+        sums[low] += d
@@ -0,0 +1,105 @@
+import random
+import unittest
+import shared
+from autocomplete import PlayerNameIndex
+from game_queue import Player, Queue
+
+
+def make_player(name: str) -> Player:
+    return Player(name=name, mmr=0, lr=0, time_queued=None, can_host=False, drop_warned=False, queue_channel_id=0,
+                  discord_id=0, last_active=None, discord_member=None)
+
+
+def expected_search(names, query: str):
+    """What search should return, found by scanning every name"""
+    query = query.lower()
+    prefix = sorted(name for name in names if name.lower().startswith(query))
+    substring = sorted(name for name in names if query in name.lower() and not name.lower().startswith(query))
+    return (prefix + substring)[:PlayerNameIndex.MAX_CHOICES]
+
+
+class PlayerNameIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = Queue()
+        self.index = PlayerNameIndex(self.queue)
+
+    def test_prefix_matches_come_first(self):
+        for name in ("Bob", "abba", "Babel", "cabbage", "bobby"):
+            self.queue.add_to_queue(make_player(name))
+        self.assertEqual(self.index.search("b"), ["Babel", "Bob", "bobby", "abba", "cabbage"])
+        self.assertEqual(self.index.search("BB"), ["abba", "bobby", "cabbage"])
+        self.assertEqual(self.index.search("abbag"), ["cabbage"])
+        self.assertEqual(self.index.search("z"), [])
+
+    def test_choices_are_capped(self):
+        for i in range(40):
+            self.queue.add_to_queue(make_player(f"x{i:02}"))
+        self.queue.add_to_queue(make_player("ax"))
+        results = self.index.search("x")
+        self.assertEqual(len(results), PlayerNameIndex.MAX_CHOICES)
+        self.assertEqual(results, [f"x{i:02}" for i in range(PlayerNameIndex.MAX_CHOICES)])
+
+    def test_queue_changes_invalidate_cache(self):
+        self.queue.add_to_queue(make_player("alpha"))
+        self.assertEqual(self.index.search("al"), ["alpha"])
+        self.queue.add_to_queue(make_player("also"))
+        self.assertEqual(self.index.search("al"), ["alpha", "also"])
+        self.queue.remove_from_queue(make_player("alpha"))
+        self.assertEqual(self.index.search("al"), ["also"])
+
+    def test_removing_prunes_trie_branches(self):
+        self.queue.add_to_queue(make_player("abc"))
+        self.queue.add_to_queue(make_player("abd"))
+        self.queue.remove_from_queue(make_player("abc"))
+        self.assertNotIn("c", self.index.trie["a"]["b"])
+        self.assertIn("d", self.index.trie["a"]["b"])
+        self.queue.remove_from_queue(make_player("abd"))
+        self.assertEqual(self.index.trie, {"entries": set()})
+        self.assertEqual(len(self.index.ngrams), 0)
+        self.assertEqual(self.index.names, {})
+
+    def test_renamed_player_is_found_by_new_name(self):
+        class Member:
+            display_name = "OldName"
+        member = Member()
+        player = make_player("OldName")
+        player.discord_member = member
+        testing, shared.TESTING = shared.TESTING, False
+        try:
+            self.queue.add_to_queue(player)
+            self.queue.add_to_queue(make_player("other"))
+            self.assertEqual(self.index.search("old"), ["OldName"])
+            member.display_name = "NewName"
+            self.index.refresh(player)
+            self.assertEqual(self.index.search("old"), [])
+            self.assertEqual(self.index.search("new"), ["NewName"])
+            member.display_name = "Renamed"
+            self.index.refresh_all()
+            self.assertEqual(self.index.search("name"), ["Renamed"])
+            self.queue.remove_from_queue(player)
+            self.assertEqual(self.index.search("re"), [])
+            self.assertEqual(self.index.search(""), ["other"])
+        finally:
+            shared.TESTING = testing
+
+    def test_matches_substring_scan(self):
+        rng = random.Random(39)
+        alphabet = "abAB_c"
+        queued = []
+        for step in range(600):
+            if len(queued) > 0 and rng.random() < 0.4:
+                player = queued.pop(rng.randrange(len(queued)))
+                self.index.remove(player)
+            else:
+                player = make_player("".join(rng.choice(alphabet) for _ in range(rng.randint(1, 8))))
+                queued.append(player)
+                self.index.add(player)
+            names = [player.name for player in queued]
+            for _ in range(3):
+                query = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 6)))
+                self.assertEqual(self.index.search(query), expected_search(names, query),
+                                 f"Step {step}, query {query!r}, names {names}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import asyncio
+import datetime
+import unittest
+from deadlines import DeadlineScheduler
+
+
+class DeadlineSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.scheduler = DeadlineScheduler()
+        self.scheduler.start()
+        self.fired = []
+
+    async def asyncTearDown(self):
+        self.scheduler.sleeper.cancel()
+
+    def event(self, seconds: float, name: str):
+        async def callback():
+            self.fired.append(name)
+        return datetime.datetime.now() + datetime.timedelta(seconds=seconds), callback
+
+    async def test_fires_in_deadline_order(self):
+        self.scheduler.schedule("a", [self.event(0.15, "a2"), self.event(0.05, "a1")])
+        self.scheduler.schedule("b", [self.event(0.1, "b1")])
+        # An earlier deadline scheduled later wakes the sleeper up
+        self.scheduler.schedule("c", [self.event(0.01, "c1")])
+        self.assertEqual(self.scheduler.pending_count(), 4)
+        await asyncio.sleep(0.3)
+        self.assertEqual(self.fired, ["c1", "a1", "b1", "a2"])
+        self.assertEqual(self.scheduler.pending_count(), 0)
+
+    async def test_reschedule_replaces_pending_events(self):
+        self.scheduler.schedule("a", [self.event(0.05, "old")])
+        self.scheduler.schedule("a", [self.event(0.1, "new")])
+        self.assertEqual(self.scheduler.pending_count(), 1)
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.fired, ["new"])
+
+    async def test_cancel(self):
+        self.scheduler.schedule("a", [self.event(0.05, "a")])
+        self.scheduler.schedule("b", [self.event(0.05, "b")])
+        self.scheduler.cancel("a")
+        self.scheduler.cancel("not scheduled")
+        await asyncio.sleep(0.15)
+        self.assertEqual(self.fired, ["b"])
+
+    async def test_cancel_then_schedule_does_not_revive_old_events(self):
+        self.scheduler.schedule("a", [self.event(0.05, "cancelled")])
+        self.scheduler.cancel("a")
+        self.scheduler.schedule("a", [self.event(0.1, "current")])
+        self.assertEqual(self.scheduler.pending_count(), 1)
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.fired, ["current"])
+
+    async def test_failing_callback_does_not_stop_the_scheduler(self):
+        async def fail():
+            raise ValueError("deadline failed")
+        self.scheduler.schedule("a", [(datetime.datetime.now(), fail)])
+        self.scheduler.schedule("b", [self.event(0.05, "b")])
+        with self.assertLogs(level="CRITICAL"):
+            await asyncio.sleep(0.15)
+        self.assertEqual(self.fired, ["b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import pickle
+import unittest
+from game_queue import Group, Player, Queue, TooManyPlayers
+
+
+def make_player(name: str, discord_id: int = 0, mmr: int = 0) -> Player:
+    return Player(name=name, mmr=mmr, lr=mmr, time_queued=None, can_host=False, drop_warned=False,
+                  queue_channel_id=0, discord_id=discord_id, last_active=None, discord_member=None)
+
+
+class FakeGuild:
+    def __init__(self, member_ids):
+        self.member_ids = set(member_ids)
+
+    def get_member(self, discord_id):
+        return object() if discord_id in self.member_ids else None
+
+
+class QueueEventTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = Queue()
+        self.events = []
+        self.queue.subscribe(lambda queue, event, players: self.events.append((event, [p.name for p in players])))
+
+    def assertEvents(self, *events):
+        """Checks the events since the last call, and that version went up once per event"""
+        self.assertEqual(self.events, list(events))
+        self.assertEqual(self.queue.version, self.version_before + len(events))
+        self.events.clear()
+        self.version_before = self.queue.version
+
+    def queue_players(self, *names):
+        players = [make_player(name, discord_id=i + 1) for i, name in enumerate(names)]
+        for player in players:
+            self.queue.add_to_queue(player)
+        self.events.clear()
+        self.version_before = self.queue.version
+        return players
+
+    def test_add_and_remove(self):
+        self.version_before = 0
+        a = make_player("a")
+        self.queue.add_to_queue(a)
+        self.assertEvents((Queue.ADDED, ["a"]))
+        self.assertIn(make_player("a"), self.queue)
+        self.assertIs(self.queue.remove_from_queue(make_player("a")), a)
+        self.assertEvents((Queue.REMOVED, ["a"]))
+        self.assertEqual(len(self.queue), 0)
+        self.assertIsNone(self.queue.remove_from_queue(a))
+        self.assertEvents()
+
+    def test_merge_and_splinter(self):
+        a, b, c = self.queue_players("a", "b", "c")
+        group_a = self.queue.get_group(a)
+        self.assertIs(self.queue.merge_into_group(group_a, b), b)
+        self.assertEvents((Queue.MERGED, ["b"]))
+        self.assertEqual(len(self.queue), 2)
+        self.assertEqual([p.name for p in group_a], ["a", "b"])
+        # Already in the group, nothing changes
+        self.assertIsNone(self.queue.merge_into_group(group_a, b))
+        self.assertIsNone(self.queue.merge_into_group(group_a, make_player("not queued")))
+        self.assertEvents()
+
+        self.queue.splinter_from_group(b)
+        self.assertEvents((Queue.SPLINTERED, ["b"]))
+        self.assertEqual(sorted(len(group) for group in self.queue), [1, 1, 1])
+
+    def test_merge_into_full_group(self):
+        players = self.queue_players(*(f"p{i}" for i in range(Group.MAX_PLAYERS + 1)))
+        group = self.queue.get_group(players[0])
+        for player in players[1:Group.MAX_PLAYERS]:
+            self.queue.merge_into_group(group, player)
+        self.events.clear()
+        self.version_before = self.queue.version
+        with self.assertRaises(TooManyPlayers):
+            self.queue.merge_into_group(group, players[-1])
+        self.assertEvents()
+
+    def test_set_host(self):
+        a, = self.queue_players("a")
+        self.assertIs(self.queue.set_host(make_player("a"), True), a)
+        self.assertTrue(a.can_host)
+        self.assertEvents((Queue.HOST_UPDATED, ["a"]))
+        self.queue.set_host(a, True)
+        self.assertEvents()
+
+    def test_update_ratings(self):
+        a, b = self.queue_players("a", "b")
+        ratings = {"a": (1000, 900), "b": (b.mmr, b.lr)}
+        self.assertEqual(self.queue.update_ratings(lambda p: ratings.get(p.name)), [a])
+        self.assertEqual((a.mmr, a.lr), (1000, 900))
+        self.assertEvents((Queue.RATINGS_UPDATED, ["a"]))
+        self.queue.update_ratings(lambda p: ratings.get(p.name))
+        self.queue.update_ratings(lambda p: None)
+        self.assertEvents()
+
+    def test_load(self):
+        self.queue_players("a")
+        self.queue.load([Group([make_player("b"), make_player("c")]), Group([])])
+        self.assertEvents((Queue.REMOVED, ["a"]), (Queue.ADDED, ["b", "c"]))
+        self.assertEqual(len(self.queue), 1)
+        self.queue.load([])
+        self.assertEvents((Queue.REMOVED, ["b", "c"]))
+
+    def test_reload(self):
+        self.queue_players("a", "b", "c")
+        self.queue.merge_into_group(self.queue.get_group(make_player("a")), make_player("b"))
+        self.events.clear()
+        self.version_before = self.queue.version
+        self.queue.reload(FakeGuild([1]))
+        self.assertEvents((Queue.REMOVED, ["b", "c"]))
+        self.assertEqual([[p.name for p in group] for group in self.queue], [["a"]])
+        self.queue.reload(FakeGuild([1]))
+        self.assertEvents()
+
+    def test_discord_id_index_follows_changes(self):
+        a, b = self.queue_players("a", "b")
+        self.assertEqual(self.queue.get_players_by_discord_id(2), [b])
+        self.queue.remove_from_queue(b)
+        self.assertFalse(self.queue.has_discord_id(2))
+        self.assertTrue(self.queue.has_discord_id(1))
+
+    def test_listener_errors_do_not_stop_others(self):
+        self.queue.subscribe(lambda *_: 1 / 0)
+        self.queue.subscribe(self.queue._listeners[0])
+        self.assertEqual(len(self.queue._listeners), 2)
+        with self.assertLogs(level="CRITICAL"):
+            self.queue_players("a")
+        self.queue.unsubscribe(self.queue._listeners[1])
+        self.queue.add_to_queue(make_player("b"))
+        self.assertEqual(self.events, [(Queue.ADDED, ["b"])])
+
+    def test_pickle_drops_listeners(self):
+        a, b = self.queue_players("a", "b")
+        self.queue.get_players_by_discord_id(1)
+        state = self.queue.__getstate__()
+        self.assertNotIn("_listeners", state)
+        self.assertNotIn("_discord_id_index", state)
+        copy = pickle.loads(pickle.dumps(self.queue))
+        self.assertEqual(copy._listeners, [])
+        self.assertEqual(copy.version, self.queue.version)
+        self.assertEqual([[p.name for p in group] for group in copy], [["a"], ["b"]])
+        copy.add_to_queue(make_player("c"))
+        self.assertEqual(self.events, [])
+        self.assertEqual(copy.get_players_by_discord_id(2)[0].name, "b")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+import outbound
+
+
+class FakeChannel:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send(self, content):
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        self.sent.append(content)
+        return content
+
+
+class FakeBot:
+    def __init__(self, channels):
+        self.channels = channels
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+
+class MessageDispatcherTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.old_window = outbound.MessageDispatcher.COALESCE_WINDOW
+        outbound.MessageDispatcher.COALESCE_WINDOW = 0.01
+
+    def tearDown(self):
+        outbound.MessageDispatcher.COALESCE_WINDOW = self.old_window
+
+    async def test_messages_are_coalesced(self):
+        channel = FakeChannel([])
+        dispatcher = outbound.MessageDispatcher(FakeBot({1: channel}))
+        futures = [dispatcher.send(1, "a"), dispatcher.send(1, "b"), dispatcher.send(1, "c", coalesce=False)]
+        results = await asyncio.wait_for(asyncio.gather(*futures), 1)
+        self.assertEqual(results, ["a\nb", "a\nb", "c"])
+        self.assertEqual(channel.sent, ["a\nb", "c"])
+
+    async def test_unexpected_send_error_fails_only_that_message(self):
+        channel = FakeChannel([ConnectionResetError("connection reset"), asyncio.TimeoutError()])
+        dispatcher = outbound.MessageDispatcher(FakeBot({1: channel}))
+        with self.assertLogs(level="CRITICAL"):
+            failed = await asyncio.wait_for(dispatcher.send(1, "lost", coalesce=False), 1)
+            failed_again = await asyncio.wait_for(dispatcher.send(1, "lost too", coalesce=False), 1)
+        self.assertIsNone(failed)
+        self.assertIsNone(failed_again)
+        # The worker survives and later messages still go out
+        self.assertEqual(await asyncio.wait_for(dispatcher.send(1, "sent"), 1), "sent")
+        self.assertEqual(dispatcher.messages_failed, 2)
+        self.assertEqual(dispatcher.messages_sent, 1)
+
+    async def test_futures_resolve_when_worker_is_cancelled(self):
+        class HangingChannel:
+            async def send(self, content):
+                await asyncio.sleep(60)
+        dispatcher = outbound.MessageDispatcher(FakeBot({1: HangingChannel()}))
+        future = dispatcher.send(1, "never sent", coalesce=False)
+        await asyncio.sleep(0.01)
+        dispatcher.outboxes[1].worker.cancel()
+        self.assertIsNone(await asyncio.wait_for(future, 1))
+
+    async def test_unknown_channel(self):
+        dispatcher = outbound.MessageDispatcher(FakeBot({}))
+        with self.assertLogs(level="WARNING"):
+            self.assertIsNone(await asyncio.wait_for(dispatcher.send(5, "nowhere"), 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
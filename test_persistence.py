@@ -0,0 +1,107 @@
+import asyncio
+import os
+import pickle
+import tempfile
+import time
+import unittest
+import persistence
+
+
+class PersistenceWriterTest(unittest.IsolatedAsyncioTestCase):
+    real_serialize_and_write = staticmethod(persistence.serialize_and_write)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "data.pkl")
+        self.state = {"v": 0}
+        self.writer = persistence.PersistenceWriter()
+        self.writer.register(self.path, lambda: dict(self.state))
+        self.writer.mark_loaded(self.path)
+        self.old_window = persistence.PersistenceWriter.WRITE_WINDOW
+        persistence.PersistenceWriter.WRITE_WINDOW = 0.05
+
+    def tearDown(self):
+        persistence.PersistenceWriter.WRITE_WINDOW = self.old_window
+        persistence.serialize_and_write = self.real_serialize_and_write
+        self.directory.cleanup()
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return pickle.load(f)
+
+    async def wait_for_flush(self):
+        while self.writer.flush_task is not None and not self.writer.flush_task.done():
+            await asyncio.sleep(0.01)
+
+    async def test_burst_is_one_write(self):
+        for v in range(1, 6):
+            self.state["v"] = v
+            self.writer.mark_dirty(self.path)
+        await self.wait_for_flush()
+        self.assertEqual(self.read(), {"v": 5})
+        self.assertEqual(self.writer.writes, 1)
+        self.assertEqual(self.writer.dirty, set())
+
+    async def test_change_during_write_is_written(self):
+        def slow_serialize_and_write(path, snapshot):
+            time.sleep(0.2)
+            return self.real_serialize_and_write(path, snapshot)
+        persistence.serialize_and_write = slow_serialize_and_write
+
+        self.state["v"] = 1
+        self.writer.mark_dirty(self.path)
+        # Wait until the first write is in progress in the worker thread
+        while self.writer.writes == 0 and not self.writer.write_lock.locked():
+            await asyncio.sleep(0.01)
+        self.state["v"] = 2
+        self.writer.mark_dirty(self.path)
+        await self.wait_for_flush()
+        self.assertEqual(self.read(), {"v": 2})
+        self.assertEqual(self.writer.writes, 2)
+        self.assertEqual(self.writer.dirty, set())
+
+    async def test_close_writes_everything_now(self):
+        persistence.PersistenceWriter.WRITE_WINDOW = 60
+        self.state["v"] = 3
+        self.writer.mark_dirty(self.path)
+        await self.writer.close()
+        self.assertEqual(self.read(), {"v": 3})
+        self.assertTrue(self.writer.flush_task.done())
+
+    async def test_close_only_writes_dirty_files_once(self):
+        other_path = os.path.join(self.directory.name, "other.pkl")
+        self.writer.register(other_path, lambda: {"other": True})
+        self.writer.mark_loaded(other_path)
+        self.writer.mark_dirty(self.path)
+        await self.writer.close()
+        await self.writer.close()
+        self.assertEqual(self.writer.writes, 1)
+        self.assertFalse(os.path.exists(other_path))
+
+    async def test_files_never_loaded_are_not_written(self):
+        with open(self.path, "wb") as f:
+            pickle.dump({"v": "saved"}, f)
+        writer = persistence.PersistenceWriter()
+        writer.register(self.path, lambda: dict(self.state))
+        writer.mark_dirty(self.path)
+        with self.assertLogs(level="WARNING"):
+            await writer.flush_all()
+            await writer.close()
+        self.assertEqual(self.read(), {"v": "saved"})
+        self.assertEqual(writer.writes, 0)
+        self.assertIn(self.path, writer.stats_str().splitlines()[-1])
+
+        writer.mark_loaded(self.path)
+        await writer.flush_all()
+        self.assertEqual(self.read(), {"v": 0})
+
+    async def test_failed_snapshot_is_counted(self):
+        self.writer.register(self.path, lambda: 1 / 0)
+        await self.writer.flush([self.path])
+        self.assertEqual(self.writer.failed_writes, 1)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,7 @@
+import itertools
+import random
 import unittest
+import algorithm
 from game_queue import Player
 
 Room = None
@@ -62,6 +65,45 @@ class EvenRoomTest(unittest.TestCase):
         team_2_mmr_sum = sum(p.mmr for p in team_2)
         self.assertTrue(abs(team_1_mmr_sum-team_2_mmr_sum) == 5, "Total difference between team mmrs should be 5.")
 
+    def test_room_even_teams_matches_brute_force(self):
+        rng = random.Random(1023)
+        for lineup_size in (12, 13, 16):
+            players = []
+            for i in range(lineup_size):
+                mmr = rng.randrange(-2000, 14000)
+                players.append(Player(name=f"Player #{i}", mmr=mmr, lr=mmr, time_queued=None, can_host=False,
+                                      drop_warned=False, queue_channel_id=0, discord_id=0, last_active=None,
+                                      discord_member=None))
+            total = sum(algorithm.get_mmr(p) for p in players)
+            best_difference = min(abs(total - 2 * sum(algorithm.get_mmr(p) for p in team))
+                                  for team in itertools.combinations(players, lineup_size // 2))
+
+            self.room_2.make_even_teams(players, 2)
+            team_1, team_2 = self.room_2.teams
+            self.assertEqual(len(team_1), lineup_size // 2)
+            self.assertEqual(set(team_1) | set(team_2), set(players))
+            difference = abs(sum(algorithm.get_mmr(p) for p in team_1) - sum(algorithm.get_mmr(p) for p in team_2))
+            self.assertEqual(difference, best_difference,
+                             f"Teams for {lineup_size} players are not as even as possible.")
+
+
+    def test_room_balanced_teams(self):
+        sorted_players = sorted(self.players_2, key=algorithm.get_mmr, reverse=True)
+        # Smallest possible spreads for players_2, found by brute force
+        for vote, team_size, best_spread in (("2v2", 2, 40), ("3v3", 3, 15), ("4v4", 4, 10)):
+            self.room_2.winning_vote = vote
+            self.room_2.make_teams()
+            self.assertTrue(all(len(team) == team_size for team in self.room_2.teams),
+                            f"Every {vote} team should have {team_size} players.")
+            self.assertEqual(set(p for team in self.room_2.teams for p in team), set(self.players_2))
+
+            team_sums = [sum(algorithm.get_mmr(p) for p in team) for team in self.room_2.teams]
+            self.assertEqual(max(team_sums) - min(team_sums), self.room_2.team_spread)
+            # Should at least beat putting the highest rated players together
+            sliced_sums = [sum(algorithm.get_mmr(p) for p in sorted_players[i:i + team_size])
+                           for i in range(0, len(sorted_players), team_size)]
+            self.assertLess(self.room_2.team_spread, max(sliced_sums) - min(sliced_sums))
+            self.assertEqual(self.room_2.team_spread, best_spread, f"{vote} teams are not as balanced as possible.")
 
 
 def set_room(r):
@@ -0,0 +1,171 @@
+import datetime
+import pickle
+import unittest
+from unittest import mock
+import game_queue
+import shared
+from game_queue import Group, Player
+
+main = None
+
+
+def make_player(name: str, discord_id: int, mmr: int = 1000) -> Player:
+    return Player(name=name, mmr=mmr, lr=mmr, time_queued=datetime.datetime(2023, 7, 1, 12, 0), can_host=False,
+                  drop_warned=False, queue_channel_id=10, discord_id=discord_id,
+                  last_active=datetime.datetime(2023, 7, 1, 12, 5), discord_member=None)
+
+
+class FakeGuild:
+    """Has a member for every discord id except missing_id"""
+    missing_id = 666
+
+    def get_member(self, discord_id):
+        return None if discord_id == self.missing_id else object()
+
+
+def queue_layout(queue) -> list:
+    return [[(p.name, p.discord_id, p.mmr) for p in group] for group in queue]
+
+
+class SaveDataTest(unittest.TestCase):
+    def setUp(self):
+        self.guild_patch = mock.patch.object(main.bot, "get_guild", return_value=FakeGuild())
+        self.guild_patch.start()
+
+    def tearDown(self):
+        self.guild_patch.stop()
+        for ladder in main.ladders.get_all():
+            ladder.load(set(), [], None, None)
+        for room in main.rooms:
+            main.room_deadlines.cancel(room)
+        main.room_deadlines.heap.clear()
+        main.rooms.clear()
+        main.reindex_rooms()
+        main.to_restart.clear()
+        main.persistence.writer.loaded.discard(main.MAIN_DATA_FILE)
+        main.persistence.writer.dirty.discard(main.MAIN_DATA_FILE)
+
+    def make_room(self) -> "main.Room":
+        players = [make_player(f"Room player {i}", 100 + i, 1000 + 100 * i) for i in range(4)]
+        room = main.Room(players, shared.RT_LADDER)
+        room.room_channel_id = 55
+        room.winning_vote = "2v2"
+        room.votes = {"2v2": {100, 101, 102}, "FFA": {103}}
+        room.teams = [[players[0], players[3]], [players[1], players[2]]]
+        room.team_spread = 0
+        room.host_str = "Room player 2 is the host"
+        room.changed_visibility = True
+        room.finished_start = True
+        return room
+
+    @staticmethod
+    def reload_through_pickle(data):
+        return pickle.loads(pickle.dumps(data))
+
+    def assertRoomRestored(self, room, restored):
+        self.assertEqual([(p.name, p.discord_id, p.mmr) for p in restored.players],
+                         [(p.name, p.discord_id, p.mmr) for p in room.players])
+        self.assertEqual(restored.votes, room.votes)
+        self.assertEqual(restored.winning_vote, room.winning_vote)
+        self.assertEqual(restored.expiration_time, room.expiration_time)
+        self.assertEqual(restored.host_str, room.host_str)
+        self.assertTrue(restored.finished_start)
+        # Teams have to point at the room's own players, not copies
+        self.assertEqual([[restored.players.index(p) for p in team] for team in restored.teams], [[0, 3], [1, 2]])
+        self.assertTrue(all(any(p is player for player in restored.players) for team in restored.teams for p in team))
+
+    def test_room_round_trip(self):
+        room = self.make_room()
+        record = self.reload_through_pickle(room.to_record())
+        restored = main.Room.from_record(record, FakeGuild())
+        self.assertRoomRestored(room, restored)
+        self.assertTrue(all(p.discord_member is not None for p in restored.players))
+        room.teams = None
+        self.assertIsNone(main.Room.from_record(self.reload_through_pickle(room.to_record()), None).teams)
+
+    def test_save_round_trip(self):
+        rt = main.ladders.get(shared.RT_LADDER)
+        groups = [Group([make_player("A", 1), make_player("B", 2)]), Group([make_player("C", 3)])]
+        rt.load({10, 11}, groups, 20, datetime.datetime(2023, 7, 1, 11, 0))
+        room = self.make_room()
+        main.rooms.append(room)
+        expected_layout = queue_layout(rt.queue)
+
+        saved = self.reload_through_pickle(main.get_save_snapshot())
+        self.assertEqual(saved["SAVE_FORMAT"], main.SAVE_FORMAT)
+        main.apply_main_data(saved)
+
+        self.assertEqual(queue_layout(rt.queue), expected_layout)
+        self.assertEqual(rt.queue_channels, {10, 11})
+        self.assertEqual(rt.category_id, 20)
+        self.assertEqual(rt.last_room_formed, datetime.datetime(2023, 7, 1, 11, 0))
+        self.assertEqual(len(main.rooms), 1)
+        self.assertIsNot(main.rooms[0], room)
+        self.assertRoomRestored(room, main.rooms[0])
+        self.assertIn(main.MAIN_DATA_FILE, main.persistence.writer.loaded)
+
+    def test_players_without_members_are_dropped(self):
+        rt = main.ladders.get(shared.RT_LADDER)
+        rt.load(set(), [Group([make_player("A", 1), make_player("Gone", FakeGuild.missing_id)])], None, None)
+        main.apply_main_data(self.reload_through_pickle(main.get_save_snapshot()))
+        self.assertEqual(queue_layout(rt.queue), [[("A", 1, 1000)]])
+
+    def test_load_format_2_save(self):
+        room = self.make_room()
+        rt_groups = [Group([make_player("A", 1), make_player("B", 2)])]
+        ct_groups = [Group([make_player("C", 3)])]
+        saved = self.reload_through_pickle({
+            "SAVE_FORMAT": 2,
+            "RT_QUEUE": [group.to_record() for group in rt_groups],
+            "CT_QUEUE": [group.to_record() for group in ct_groups],
+            "RT_QUEUE_CHANNELS": {10},
+            "CT_QUEUE_CHANNELS": {12},
+            "RT_QUEUE_CATEGORY": 20,
+            "CT_QUEUE_CATEGORY": 21,
+            "LAST_ROOM_FORMED_TIMES": {shared.RT_LADDER: datetime.datetime(2023, 7, 1, 11, 0)},
+            "rooms": [room.to_record()]})
+        main.apply_main_data(saved)
+
+        rt, ct = main.ladders.get(shared.RT_LADDER), main.ladders.get(shared.CT_LADDER)
+        self.assertEqual(queue_layout(rt.queue), [[("A", 1, 1000), ("B", 2, 1000)]])
+        self.assertEqual(queue_layout(ct.queue), [[("C", 3, 1000)]])
+        self.assertEqual((rt.queue_channels, ct.queue_channels), ({10}, {12}))
+        self.assertEqual((rt.category_id, ct.category_id), (20, 21))
+        self.assertEqual(rt.last_room_formed, datetime.datetime(2023, 7, 1, 11, 0))
+        self.assertIsNone(ct.last_room_formed)
+        self.assertEqual(main.ladders.get_by_channel(12), ct)
+        self.assertRoomRestored(room, main.rooms[0])
+
+    def test_load_unversioned_save(self):
+        # Before records, the live queues and rooms were pickled as they were
+        room = self.make_room()
+        rt_queue = game_queue.Queue()
+        rt_queue.extend([Group([make_player("A", 1)]), Group([make_player("B", 2), make_player("C", 3)])])
+        saved = self.reload_through_pickle({
+            "RT_QUEUE": rt_queue,
+            "CT_QUEUE": game_queue.Queue(),
+            "RT_QUEUE_CHANNELS": {10},
+            "CT_QUEUE_CHANNELS": set(),
+            "RT_QUEUE_CATEGORY": 20,
+            "CT_QUEUE_CATEGORY": None,
+            "rooms": [room]})
+        main.apply_main_data(saved)
+
+        rt, ct = main.ladders.get(shared.RT_LADDER), main.ladders.get(shared.CT_LADDER)
+        self.assertEqual(queue_layout(rt.queue), [[("A", 1, 1000)], [("B", 2, 1000), ("C", 3, 1000)]])
+        self.assertEqual(len(ct.queue), 0)
+        self.assertEqual(rt.queue_channels, {10})
+        self.assertIsNone(rt.last_room_formed)
+        self.assertRoomRestored(room, main.rooms[0])
+        # The restored queue is live, changes to it reach the ladder's listeners
+        rt.queue.add_to_queue(make_player("D", 4))
+        self.assertEqual(rt.name_index.search("d"), ["D"])
+
+
+def set_main(m):
+    global main
+    main = m
+
+
+if __name__ == '__main__':
+    unittest.main()
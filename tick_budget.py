@@ -0,0 +1,83 @@
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List
+
+
+class Tick:
+    """One run of a routine. Stages are run through run so they get timed."""
+
+    def __init__(self, budget_seconds: float):
+        self.budget_seconds = budget_seconds
+        self.started = time.perf_counter()
+        self.stage_times: Dict[str, float] = {}
+        self.deferred: List[str] = []
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def over_budget(self) -> bool:
+        return self.elapsed() > self.budget_seconds
+
+    async def run(self, stage: str, run_stage: Callable[[], Awaitable], critical=True) -> bool:
+        """Runs the stage and records how long it took. Non-critical stages are deferred instead when the tick is
+        already over budget. Returns whether the stage ran."""
+        if not critical and self.over_budget():
+            self.deferred.append(stage)
+            return False
+        started = time.perf_counter()
+        try:
+            await run_stage()
+        finally:
+            self.stage_times[stage] = time.perf_counter() - started
+        return True
+
+    def breakdown_str(self) -> str:
+        stages = ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in self.stage_times.items())
+        result = f"{self.elapsed() * 1000:.0f}ms of {self.budget_seconds * 1000:.0f}ms ({stages})"
+        if len(self.deferred) > 0:
+            result += f", deferred: {', '.join(self.deferred)}"
+        return result
+
+
+class TickBudget:
+    """Times every tick of a periodic routine, stage by stage, against a budget.
+
+    Ticks that go over budget are logged with their per-stage breakdown. Until a tick finishes within budget again,
+    should_shed returns True so that non-critical work (e.g. status messages) is put off and the critical stages keep
+    running on time. Other reasons to shed work can be added with add_shed_condition."""
+    SLOW_TICK_HISTORY = 20
+
+    def __init__(self, name: str, budget_seconds: float):
+        self.name = name
+        self.budget_seconds = budget_seconds
+        self.ticks = 0
+        self.slow_tick_count = 0
+        self.slow_ticks: deque[str] = deque(maxlen=TickBudget.SLOW_TICK_HISTORY)
+        self.last_tick_over_budget = False
+        self.shed_conditions: List[Callable[[], bool]] = []
+
+    def start_tick(self) -> Tick:
+        return Tick(self.budget_seconds)
+
+    def finish_tick(self, tick: Tick):
+        self.ticks += 1
+        self.last_tick_over_budget = tick.over_budget()
+        if self.last_tick_over_budget:
+            self.slow_tick_count += 1
+            breakdown = tick.breakdown_str()
+            self.slow_ticks.append(breakdown)
+            logging.warning(f"{self.name} tick went over budget: {breakdown}")
+
+    def add_shed_condition(self, condition: Callable[[], bool]):
+        self.shed_conditions.append(condition)
+
+    def should_shed(self) -> bool:
+        return self.last_tick_over_budget or any(condition() for condition in self.shed_conditions)
+
+    def stats_str(self) -> str:
+        result = f"{self.name}: {self.slow_tick_count} of {self.ticks} ticks over the " \
+                 f"{self.budget_seconds * 1000:.0f}ms budget"
+        if len(self.slow_ticks) > 0:
+            result += "\nRecent slow ticks:\n" + "\n".join(self.slow_ticks)
+        return result